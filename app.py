@@ -1,9 +1,23 @@
 import streamlit as st
-import pandas as pd
-from ui_components import apply_custom_css, render_sidebar, render_chat_message, render_follow_up_buttons
-from data_handler import load_data, generate_eda_report
-from llm_agent import DataSenseAgent
-from utils import save_session, load_session, get_session_id
+from dotenv import load_dotenv
+
+# Before the modules below read their DATASENSE_* settings
+load_dotenv()
+
+from ui_components import (
+    apply_custom_css, render_sidebar, render_chat_message, render_follow_up_buttons, render_agent_progress,
+    render_profile, render_dashboard_job, debug_enabled, render_debug_panel
+)
+from data_handler import (
+    load_data, list_excel_sheets, load_excel_sheet, request_profile, needs_out_of_core, load_out_of_core,
+    list_server_files, open_server_file
+)
+from llm_agent import AgentManager
+from out_of_core import OutOfCoreDataset
+from utils import save_session, load_session, get_session_id, export_charts_to_zip_bytes
+
+# Messages rendered before "Show earlier messages"
+CHAT_WINDOW = 20
 
 # --- Page Config ---
 st.set_page_config(page_title="DataSense AI", page_icon="🤖", layout="wide")
@@ -13,11 +27,13 @@ apply_custom_css()
 def init_session_state():
     defaults = {
         "chat_history": [], "df": None, "agent": None, "session_id": None,
-        "df_info": None, "dashboard_charts": [], "session_to_load": None
+        "dashboard_charts": [], "dashboard_job": None, "session_to_load": None, "ooc_dataset": None
     }
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
+    if "agent_manager" not in st.session_state:
+        st.session_state.agent_manager = AgentManager()
 
 init_session_state()
 
@@ -26,10 +42,18 @@ if st.session_state.session_to_load:
     session_data = load_session(st.session_state.session_to_load)
     if session_data:
         st.session_state.chat_history = session_data["chat_history"]
-        df_info = session_data["dataframe_info"]
-        # Recreate the dataframe from the dictionary
-        st.session_state.df = pd.DataFrame.from_dict(df_info)
-        st.session_state.agent = DataSenseAgent(st.session_state.df)
+        # Memory-mapped from the session's Parquet file with its original dtypes
+        st.session_state.df = session_data["dataframe"]
+        st.session_state.ooc_dataset = None
+        if st.session_state.df is None and session_data["dataset_hash"]:
+            # Large datasets stay in the out-of-core store rather than the session
+            st.session_state.ooc_dataset = OutOfCoreDataset.open_cached(session_data["dataset_hash"])
+            if st.session_state.ooc_dataset is not None:
+                st.session_state.df = st.session_state.ooc_dataset.sample()
+        if st.session_state.df is not None:
+            st.session_state.agent = st.session_state.agent_manager.get_agent(
+                st.session_state.df, session_data["dataset_hash"], st.session_state.ooc_dataset
+            )
         st.session_state.session_id = st.session_state.session_to_load
         st.session_state.dashboard_charts = [
             msg['content'] for msg in st.session_state.chat_history
@@ -50,36 +74,92 @@ if st.session_state.df is None:
     uploaded_file = st.file_uploader(
         "Upload your structured data (CSV/Excel)", type=["csv", "xls", "xlsx"]
     )
-    if uploaded_file:
-        data_sheets = load_data(uploaded_file)
-        if data_sheets:
-            if len(data_sheets) > 1:
-                sheet_name = st.selectbox("Multiple sheets found. Please select one:", list(data_sheets.keys()))
-                if st.button("Confirm Sheet"):
-                    st.session_state.df = data_sheets[sheet_name]
-                    st.rerun()
-            else:
-                st.session_state.df = list(data_sheets.values())[0]
+    col1, col2 = st.columns(2)
+    optimize = col1.toggle("Optimize memory usage", value=True,
+                           help="Infer compact column types: smaller numbers, dates and categories.")
+    use_pyarrow = col2.toggle("Use Arrow engine (CSV)", value=False,
+                              help="Read CSVs with pyarrow into Arrow-backed columns.")
+    # Files too large to upload can be opened from DATASENSE_SERVER_DATA_DIR instead
+    server_files = list_server_files()
+    server_file = st.selectbox(
+        "Or open a CSV from the server", [""] + server_files, format_func=lambda name: name or "—"
+    ) if server_files else None
+    if server_file:
+        st.session_state.df, st.session_state.ooc_dataset = open_server_file(server_file, optimize, use_pyarrow)
+        if st.session_state.df is not None:
+            st.rerun()
+    elif uploaded_file and needs_out_of_core(uploaded_file):
+        # Too large for pandas: queried in place with DuckDB, previewed from a sample
+        st.session_state.ooc_dataset = load_out_of_core(uploaded_file)
+        st.session_state.df = st.session_state.ooc_dataset.sample()
+        st.rerun()
+    elif uploaded_file and uploaded_file.name.endswith(('.xls', '.xlsx')):
+        # Only the sheet the user picks is ever parsed
+        sheets = list_excel_sheets(uploaded_file)
+        if len(sheets) > 1:
+            sizes = {
+                sheet["name"]: f" ({sheet['rows']:,} rows × {sheet['columns']} columns)" if sheet["rows"] is not None else ""
+                for sheet in sheets
+            }
+            sheet_name = st.selectbox("Multiple sheets found. Please select one:", list(sizes),
+                                      format_func=lambda name: f"{name}{sizes[name]}")
+            if st.button("Confirm Sheet"):
+                st.session_state.df = load_excel_sheet(uploaded_file, sheet_name, optimize)
                 st.rerun()
+        elif sheets:
+            st.session_state.df = load_excel_sheet(uploaded_file, sheets[0]["name"], optimize)
+            if st.session_state.df is not None:
+                st.rerun()
+        else:
+            st.error("Excel file contains no sheets.")
+    elif uploaded_file:
+        data_sheets = load_data(uploaded_file, optimize, use_pyarrow)
+        if data_sheets:
+            st.session_state.df = data_sheets["data"]
+            st.rerun()
 else:
     # --- Main Interface with Tabs ---
-    st.session_state.agent = DataSenseAgent(st.session_state.df)
+    # Reuses the session's agent unless the dataset changed since the last rerun
+    st.session_state.agent = st.session_state.agent_manager.get_agent(
+        st.session_state.df, dataset=st.session_state.ooc_dataset
+    )
     tab1, tab2, tab3 = st.tabs(["💬 Chat", "🗂️ Data View", "📊 Dashboard"])
 
     with tab2:
+        if st.session_state.ooc_dataset is not None:
+            st.info(
+                f"Large file: questions run out-of-core with DuckDB. Showing a {len(st.session_state.df):,}-row "
+                f"sample of {st.session_state.ooc_dataset.row_count():,} rows."
+            )
+        memory_report = st.session_state.df.attrs.get("memory_report")
+        if memory_report:
+            st.caption(
+                f"Memory: {memory_report['before_mb']:.1f} MB → {memory_report['after_mb']:.1f} MB "
+                f"after optimizing {len(memory_report['conversions'])} column(s)."
+            )
         st.dataframe(st.session_state.df)
+        profile_mode = st.radio(
+            "Profile", ["fast", "full"], horizontal=True,
+            format_func=lambda mode: "Fast (sampled, minimal)" if mode == "fast" else "Full (all rows, slow)"
+        )
+        fingerprint = st.session_state.agent.fingerprint
         if st.button("Generate Data Profile"):
-            with st.spinner("Profiling data... This may take a moment."):
-                profile = generate_eda_report(st.session_state.df)
-                if profile:
-                    #st.components.v1.html(profile.to_html(), height=800, scrolling=True)
-                    #st.html(profile.to_html(), height=800, scroll=True)
-                    report_html = profile.to_html()
-                    st.html(f'<div style="height:800px; overflow-y: scroll;">{report_html}</div>')
+            # Built in the background and cached on disk per dataset, so later clicks are instant
+            st.session_state.profile_job = (fingerprint, profile_mode, request_profile(st.session_state.df, fingerprint, profile_mode))
+        profile_job = st.session_state.get("profile_job")
+        if profile_job and profile_job[:2] == (fingerprint, profile_mode):
+            render_profile(profile_job[2])
 
     with tab3:
         st.subheader("Dashboard")
-        if not st.session_state.dashboard_charts:
+        job = st.session_state.dashboard_job
+        if job is not None and job.done():
+            st.session_state.dashboard_charts = job.completed()
+            st.session_state.dashboard_job = job = None
+        if job is not None:
+            # Charts appear here one by one while the rest are still being built
+            render_dashboard_job(job)
+        elif not st.session_state.dashboard_charts:
             st.info("Ask for a 'dashboard' in the chat to populate this view.")
         else:
             charts = st.session_state.dashboard_charts
@@ -87,12 +167,29 @@ else:
                 cols = st.columns(2)
                 for i, fig in enumerate(charts):
                     cols[i % 2].plotly_chart(fig, use_container_width=True)
+                if st.session_state.get("dashboard_png_ready"):
+                    st.download_button(
+                        "Download All Charts (ZIP)",
+                        data=export_charts_to_zip_bytes(charts),
+                        file_name="dashboard.zip",
+                        mime="application/zip"
+                    )
+                elif st.button("Prepare PNG Downloads"):
+                    st.session_state.dashboard_png_ready = True
+                    st.rerun()
             else: # Handle single plot case if needed
                 st.plotly_chart(charts, use_container_width=True)
 
     with tab1:
-        for message in st.session_state.chat_history:
-            render_chat_message(message)
+        # Long conversations render their most recent messages first
+        history = st.session_state.chat_history
+        window = st.session_state.get("chat_window", CHAT_WINDOW)
+        first_shown = max(len(history) - window, 0)
+        if first_shown and st.button(f"Show earlier messages ({first_shown} hidden)"):
+            st.session_state.chat_window = window + CHAT_WINDOW
+            st.rerun()
+        for i in range(first_shown, len(history)):
+            render_chat_message(history[i], key=f"msg_{i}")
 
         prompt = st.chat_input("Ask about your data...")
         if "prompt_from_follow_up" in st.session_state and st.session_state.prompt_from_follow_up:
@@ -103,11 +200,11 @@ else:
 
         if prompt:
             st.session_state.chat_history.append({"role": "user", "content": prompt})
-            render_chat_message(st.session_state.chat_history[-1])
+            render_chat_message(st.session_state.chat_history[-1], key=f"msg_{len(st.session_state.chat_history) - 1}")
 
             with st.spinner("Thinking..."):
-                # Run the agent
-                response = st.session_state.agent.query(prompt)
+                # Run the agent, showing its code and progress as they stream in
+                response = render_agent_progress(st.session_state.agent.stream_query(prompt))
                 st.session_state.last_agent_response = response # Store for follow-ups
 
                 # Prepare the message for display
@@ -118,8 +215,14 @@ else:
 
                 if response_type == "dashboard":
                     st.session_state.dashboard_charts = content
+                    st.session_state.dashboard_job = response.get("dashboard_job")
+                    st.session_state.dashboard_png_ready = False
                     # Create a user-friendly message for the chat, as the dashboard is in another tab
-                    assistant_message["content"] = f"I've created a dashboard with {len(content)} charts. You can view it in the '📊 Dashboard' tab."
+                    if st.session_state.dashboard_job is not None:
+                        chart_count = len(st.session_state.dashboard_job.specs)
+                        assistant_message["content"] = f"I'm building a dashboard with {chart_count} charts. They will appear in the '📊 Dashboard' tab as each one is ready."
+                    else:
+                        assistant_message["content"] = f"I've created a dashboard with {len(content)} charts. You can view it in the '📊 Dashboard' tab."
                 else:
                     assistant_message["content"] = content
 
@@ -128,13 +231,19 @@ else:
                 # --- Session Saving Logic ---
                 if not st.session_state.session_id:
                     st.session_state.session_id = get_session_id(prompt)
-                    st.session_state.df_info = st.session_state.df.to_dict()
                 
-                save_session(
-                    st.session_state.session_id,
-                    st.session_state.chat_history,
-                    st.session_state.df_info
-                )
+                # Out-of-core datasets are already on disk; only their fingerprint is saved
+                session_dataset = st.session_state.df if st.session_state.ooc_dataset is None else None
+                try:
+                    save_session(st.session_state.session_id, st.session_state.chat_history,
+                                 session_dataset, st.session_state.agent.fingerprint)
+                except ValueError as e:
+                    # The stored session is another conversation; keep both by saving this one anew
+                    print(f"--- Session Save Conflict: {e} ---")
+                    st.session_state.session_id = get_session_id(prompt)
+                    save_session(st.session_state.session_id, st.session_state.chat_history,
+                                 session_dataset, st.session_state.agent.fingerprint)
+                    st.toast("This analysis was saved as a new session.")
             
             # Rerun to display the new messages and follow-up buttons
             st.rerun()
@@ -145,7 +254,12 @@ else:
             # This requires modifying how we store responses if we want to persist follow-ups
             # For simplicity, we'll assume the follow-ups are tied to the last agent call
             if 'last_agent_response' in st.session_state:
-                 render_follow_up_buttons(st.session_state.last_agent_response.get("follow_up_questions", []))
+                 last_response = st.session_state.last_agent_response
+                 # Follow-ups arrive in the background; the Future stands in until then
+                 render_follow_up_buttons(last_response.get("follow_up_future", last_response.get("follow_up_questions", [])))
+
+    if debug_enabled():
+        render_debug_panel(st.session_state.agent_manager)
 
 # We need to store the last agent response to render follow-ups after a rerun
 if 'response' in locals() and response:
@@ -0,0 +1,218 @@
+"""Headless batch runs of DataSense questions against a dataset file.
+
+Runs every prompt in a prompts file through DataSenseAgent, several at a
+time, and writes answers, tables, figures and timings to an output directory.
+Nothing here imports Streamlit, so it can run from cron or CI:
+
+    python batch.py sales.csv questions.txt --output nightly/ --concurrency 4
+
+Prompts files are plain text (one prompt per line, `#` for comments), a JSON
+list of strings, or JSONL objects with a "prompt" and optional "id". Each
+finished prompt is appended to `results.jsonl` at once, so an interrupted run
+picks up where it stopped; prompts that failed are tried again.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from plotly import io as pio
+
+from data_loading import read_dataset
+from llm_agent import DataSenseAgent, dataset_fingerprint
+from llm_client import get_llm_client
+from out_of_core import OUT_OF_CORE_MB, OutOfCoreDataset
+from sandbox import release_session
+
+RESULTS_FILE = "results.jsonl"
+SUMMARY_FILE = "summary.json"
+
+# --- Inputs ---
+
+def prompt_id(prompt: str) -> str:
+    return hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()[:12]
+
+def read_prompts(path: str) -> list:
+    """Returns [{"id", "prompt"}] from a .txt, .json or .jsonl prompts file."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".jsonl"):
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    elif path.endswith(".json"):
+        entries = json.loads(text)
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    prompts = []
+    for entry in entries:
+        prompt = entry if isinstance(entry, str) else entry["prompt"]
+        pid = prompt_id(prompt) if isinstance(entry, str) else str(entry.get("id") or prompt_id(prompt))
+        prompts.append({"id": pid, "prompt": prompt})
+    return prompts
+
+def load_dataset_file(path: str, sheet_name=None, optimize: bool = True, use_pyarrow: bool = False):
+    """Returns (df, out-of-core dataset or None) for a CSV or Excel file.
+
+    CSVs above DATASENSE_OUT_OF_CORE_MB are queried with DuckDB, as in the app.
+    """
+    if path.endswith(".csv") and os.path.getsize(path) > OUT_OF_CORE_MB * 1024 * 1024:
+        dataset = OutOfCoreDataset.from_csv(path)
+        return dataset.sample(), dataset
+    return read_dataset(path, optimize, use_pyarrow, sheet_name), None
+
+def completed_ids(output_dir: str) -> set:
+    """Ids of prompts that already finished successfully in an earlier run."""
+    path = os.path.join(output_dir, RESULTS_FILE)
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError: # A line cut short by an interrupted run
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+# --- Outputs ---
+
+def _write_figure(output_dir: str, name: str, fig, png: bool) -> dict:
+    os.makedirs(os.path.join(output_dir, "figures"), exist_ok=True)
+    paths = {"json": os.path.join("figures", f"{name}.json")}
+    pio.write_json(fig, os.path.join(output_dir, paths["json"]))
+    if png:
+        paths["png"] = os.path.join("figures", f"{name}.png")
+        pio.write_image(fig, os.path.join(output_dir, paths["png"]), format="png", engine="kaleido")
+    return paths
+
+def _write_table(output_dir: str, name: str, table: pd.DataFrame) -> str:
+    os.makedirs(os.path.join(output_dir, "tables"), exist_ok=True)
+    path = os.path.join("tables", f"{name}.csv")
+    table.to_csv(os.path.join(output_dir, path))
+    return path
+
+def _record_output(output_dir: str, pid: str, response: dict, png: bool) -> dict:
+    """Writes a response's figures/tables to files and returns what to put in results.jsonl."""
+    response_type, content = response.get("type"), response.get("content")
+    job = response.get("dashboard_job")
+    if job is not None:
+        figures = job.result()
+        return {
+            "figures": [_write_figure(output_dir, f"{pid}_{i}", fig, png) for i, fig in enumerate(figures)],
+            "errors": [error for error in job.errors if error],
+        }
+    if response_type == "dashboard":
+        return {"figures": [_write_figure(output_dir, f"{pid}_{i}", fig, png) for i, fig in enumerate(content)]}
+    if response_type == "plot":
+        return {"figures": [_write_figure(output_dir, pid, content["data"], png)]}
+    if response_type == "dataframe":
+        return {"table": _write_table(output_dir, pid, content["data"]), "total_rows": content["total_rows"]}
+    return {"answer": str(content)}
+
+# --- Runner ---
+
+def _run_prompt(df, fingerprint: str, dataset, entry: dict, output_dir: str, follow_ups: bool, png: bool) -> dict:
+    # One agent per prompt gives each concurrent run its own sandbox session;
+    # the compiled graph and the dataset's statistics are shared
+    agent = DataSenseAgent(df, fingerprint, dataset=dataset)
+    start = time.perf_counter()
+    record = {"id": entry["id"], "prompt": entry["prompt"]}
+    try:
+        response = agent.query(entry["prompt"], follow_ups=follow_ups)
+        record.update(_record_output(output_dir, entry["id"], response, png))
+        record["type"] = response.get("type")
+        if follow_ups and response.get("follow_up_future") is not None:
+            record["follow_up_questions"] = response["follow_up_future"].result()
+        if response.get("error"):
+            record["error"] = response["error"]
+        record["status"] = "error" if response.get("error") else "ok"
+    except Exception as e:
+        record.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    finally:
+        release_session(agent.session_id)
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+def run_batch(dataset_path: str, prompts: list, output_dir: str, concurrency: int = 4, sheet_name=None,
+              optimize: bool = True, resume: bool = True, follow_ups: bool = False, png: bool = False) -> dict:
+    """Answers `prompts` against a dataset file and writes the results to `output_dir`.
+
+    Returns the run summary, which is also saved as summary.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    if not resume and os.path.exists(results_path):
+        os.remove(results_path)
+    skip = completed_ids(output_dir) if resume else set()
+    pending = [entry for entry in prompts if entry["id"] not in skip]
+    print(f"--- Batch: {len(pending)} to run, {len(prompts) - len(pending)} already completed ---")
+
+    load_start = time.perf_counter()
+    df, dataset = load_dataset_file(dataset_path, sheet_name, optimize)
+    fingerprint = dataset.fingerprint if dataset is not None else dataset_fingerprint(df)
+    load_seconds = time.perf_counter() - load_start
+
+    records, write_lock = [], threading.Lock()
+    run_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="batch") as executor:
+        futures = [executor.submit(_run_prompt, df, fingerprint, dataset, entry, output_dir, follow_ups, png)
+                   for entry in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            with write_lock, open(results_path, 'a', encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            print(f"--- Batch [{record['status']}] {record['seconds']:.2f}s: {record['prompt'][:60]} ---")
+    wall_seconds = time.perf_counter() - run_start
+
+    seconds = sorted(record["seconds"] for record in records)
+    summary = {
+        "dataset": os.path.abspath(dataset_path),
+        "fingerprint": fingerprint,
+        "rows": dataset.row_count() if dataset is not None else len(df),
+        "prompts": len(prompts),
+        "skipped": len(prompts) - len(pending),
+        "ok": sum(record["status"] == "ok" for record in records),
+        "errors": sum(record["status"] != "ok" for record in records),
+        "concurrency": concurrency,
+        "load_seconds": round(load_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "prompt_seconds": {
+            "mean": round(statistics.fmean(seconds), 3) if seconds else None,
+            "p50": seconds[len(seconds) // 2] if seconds else None,
+            "p95": seconds[min(int(len(seconds) * 0.95), len(seconds) - 1)] if seconds else None,
+        },
+        "llm": get_llm_client().metrics(),
+    }
+    with open(os.path.join(output_dir, SUMMARY_FILE), 'w') as f:
+        json.dump(summary, f, indent=2, default=str)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a file of questions against a dataset without the web app.")
+    parser.add_argument("dataset", help="CSV or Excel file to analyse.")
+    parser.add_argument("prompts", help="Prompts file (.txt, .json or .jsonl).")
+    parser.add_argument("--output", default="batch_results", help="Directory for results, figures and timings.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Prompts answered at the same time.")
+    parser.add_argument("--sheet", default=None, help="Excel sheet to use (default: the first).")
+    parser.add_argument("--no-optimize", action="store_true", help="Keep pandas' default dtypes.")
+    parser.add_argument("--no-resume", action="store_true", help="Start over instead of skipping completed prompts.")
+    parser.add_argument("--follow-ups", action="store_true", help="Also generate follow-up questions.")
+    parser.add_argument("--png", action="store_true", help="Also export figures as PNG (needs kaleido).")
+    args = parser.parse_args()
+
+    summary = run_batch(
+        args.dataset, read_prompts(args.prompts), args.output, args.concurrency, args.sheet,
+        optimize=not args.no_optimize, resume=not args.no_resume, follow_ups=args.follow_ups, png=args.png
+    )
+    print(f"Batch finished: {summary['ok']} ok, {summary['errors']} failed, {summary['skipped']} skipped. "
+          f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
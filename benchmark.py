@@ -0,0 +1,233 @@
+"""Offline benchmark of the DataSense agent pipeline.
+
+Drives DataSenseAgent.query against synthetic datasets with a scripted fake
+LLM, so no Gemini calls are made, and writes per-node latency, peak memory and
+throughput as JSON for comparison between releases:
+
+    python benchmark.py --rows 10000 1000000 10000000 --output bench_results.json
+
+The run exits non-zero if any workload question comes back as an error, so CI
+can run it as a smoke test of the whole graph.
+
+`--startup` instead measures how long the app's modules take to import in a
+fresh interpreter, and which of their imports are slowest.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import statistics
+import tracemalloc
+from collections import defaultdict
+
+# Keep benchmark caches away from the app's
+os.environ["DATASENSE_CACHE_DIR"] = tempfile.mkdtemp(prefix="datasense_bench_")
+
+import numpy as np
+import pandas as pd
+
+import llm_agent
+from llm_agent import DataSenseAgent, resolve_follow_ups
+from llm_client import FakeLLMBackend, set_llm_backend
+
+# --- Scripted Workload ---
+# Each question maps to the code a well-behaved LLM would return for it
+WORKLOAD = {
+    "What is the average sales by region?":
+        "df.groupby('region')['sales'].mean()",
+    "Plot total profit by category as a bar chart":
+        "go.Figure(data=[go.Bar(x=df.groupby('category')['profit'].sum().index.astype(str), "
+        "y=df.groupby('category')['profit'].sum().values)])",
+    "Show the 10 orders with the largest quantity":
+        "df.nlargest(10, 'quantity')",
+    "How many orders were placed each month?":
+        "df.groupby(df['order_date'].dt.to_period('M')).size().to_string()",
+}
+FOLLOW_UPS = json.dumps({"follow_up_questions": [
+    "Which region has the highest profit?",
+    "How do sales trend over time?",
+    "What is the average quantity per order?",
+]})
+
+def scripted_llm(prompt: str) -> str:
+    if "follow-up questions" in prompt:
+        return FOLLOW_UPS
+    for question, code in WORKLOAD.items():
+        if question in prompt:
+            return code
+    return "'unrecognised question'"
+
+def make_dataset(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Builds a sales-like table with categorical, date and numeric columns."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "order_id": np.arange(rows),
+        "region": rng.choice(["North", "South", "East", "West", "Central"], rows),
+        "category": rng.choice([f"Category {i}" for i in range(10)], rows),
+        "order_date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1460, rows), unit="D"),
+        "quantity": rng.integers(1, 50, rows),
+        "sales": rng.gamma(2.0, 150.0, rows).round(2),
+        "profit": rng.normal(40.0, 25.0, rows).round(2),
+    })
+
+# --- Measurement ---
+def run_query(agent: DataSenseAgent, prompt: str, node_times: dict) -> dict:
+    node_times.clear()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    response = agent.query(prompt)
+    answered = time.perf_counter() - start
+    resolve_follow_ups(response)
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    return {
+        "prompt": prompt,
+        "response_type": response.get("type"),
+        "error": response.get("error"),
+        "answer_seconds": answered,
+        "follow_up_seconds": total - answered,
+        "total_seconds": total,
+        "nodes": {name: sum(times) for name, times in node_times.items()},
+        "peak_traced_mb": peak / (1024 * 1024),
+    }
+
+def failed_runs(report: dict) -> list:
+    """Runs whose response carried an error; any of these fails the benchmark."""
+    return [
+        {"rows": result["rows"], "phase": phase, "prompt": run["prompt"], "error": run["error"]}
+        for result in report.get("results", [])
+        for phase in ("cold", "cached")
+        for run in result[phase]["runs"]
+        if run.get("error")
+    ]
+
+def summarize(runs: list) -> dict:
+    by_node = defaultdict(list)
+    for run in runs:
+        for name, seconds in run["nodes"].items():
+            by_node[name].append(seconds)
+    answer_times = [run["answer_seconds"] for run in runs]
+    return {
+        "queries": len(runs),
+        "throughput_qps": len(runs) / sum(run["total_seconds"] for run in runs) if runs else 0.0,
+        "answer_seconds_p50": statistics.median(answer_times) if runs else None,
+        "answer_seconds_max": max(answer_times) if runs else None,
+        "peak_traced_mb": max((run["peak_traced_mb"] for run in runs), default=0.0),
+        "nodes": {
+            name: {"mean": statistics.mean(times), "max": max(times), "calls": len(times)}
+            for name, times in by_node.items()
+        },
+    }
+
+def benchmark(rows_list: list, llm_latency: float) -> dict:
+    set_llm_backend(FakeLLMBackend(scripted_llm, latency=llm_latency), requests_per_minute=1e9)
+    node_times = defaultdict(list)
+    llm_agent.NODE_OBSERVERS.append(lambda name, seconds, update: node_times[name].append(seconds))
+
+    results = []
+    tracemalloc.start()
+    for rows in rows_list:
+        print(f"=== {rows:,} rows ===")
+        start = time.perf_counter()
+        df = make_dataset(rows)
+        build_start = time.perf_counter()
+        agent = DataSenseAgent(df)
+        build_seconds = time.perf_counter() - build_start
+        cold = [run_query(agent, prompt, node_times) for prompt in WORKLOAD]
+        # The same questions again are answered from the query cache
+        cached = [run_query(agent, prompt, node_times) for prompt in WORKLOAD]
+        results.append({
+            "rows": rows,
+            "dataset_mb": df.memory_usage(deep=True).sum() / (1024 * 1024),
+            "dataset_build_seconds": build_start - start,
+            "agent_build_seconds": build_seconds,
+            "cold": {"summary": summarize(cold), "runs": cold},
+            "cached": {"summary": summarize(cached), "runs": cached},
+        })
+        print(json.dumps(results[-1]["cold"]["summary"], indent=2))
+        del agent, df
+    tracemalloc.stop()
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "llm_latency_seconds": llm_latency,
+            # ru_maxrss is kilobytes on Linux and bytes on macOS
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 * 1024),
+        },
+        "results": results,
+    }
+
+# --- Startup ---
+# Modules whose import cost the app (or a headless script) pays before doing anything
+STARTUP_MODULES = ["app_imports", "llm_agent", "data_handler", "batch"]
+_APP_IMPORTS = "import ui_components, data_handler, llm_agent, out_of_core, utils"
+
+def _parse_importtime(stderr: str, top: int = 8) -> list:
+    """Slowest top-level imports from `python -X importtime` output, in milliseconds."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name[1:2] != " ": # Nested imports are indented
+            imports.append({"module": name.strip(), "cumulative_ms": int(cumulative) / 1000})
+    return sorted(imports, key=lambda item: item["cumulative_ms"], reverse=True)[:top]
+
+def measure_startup(modules: list = STARTUP_MODULES, repeats: int = 3) -> dict:
+    """Cold import time of each module in a fresh interpreter (best of `repeats`)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        statement = _APP_IMPORTS if module == "app_imports" else f"import {module}"
+        wall, slowest = [], []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", statement],
+                cwd=here, capture_output=True, text=True
+            )
+            wall.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                results[module] = {"error": completed.stderr.strip().splitlines()[-1]}
+                break
+            slowest = _parse_importtime(completed.stderr)
+        else:
+            results[module] = {"seconds": min(wall), "slowest_imports": slowest}
+        print(f"--- Startup {module}: {results[module]} ---")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline DataSense agent benchmark.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000],
+                        help="Dataset sizes to benchmark.")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="Simulated seconds per LLM call.")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON report.")
+    parser.add_argument("--startup", action="store_true", help="Only measure cold import times of the app modules.")
+    args = parser.parse_args()
+
+    if args.startup:
+        report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0]},
+                  "startup": measure_startup()}
+    else:
+        report = benchmark(args.rows, args.llm_latency)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark report written to {args.output}")
+
+    failures = failed_runs(report)
+    for failure in failures:
+        print(f"--- Benchmark Failure: {failure} ---")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
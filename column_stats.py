@@ -0,0 +1,224 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Set DATASENSE_FAST_PATH=0 to send every question through the LLM graph
+FAST_PATH_ENABLED = os.getenv("DATASENSE_FAST_PATH", "1") != "0"
+# Most frequent values kept per column
+STATS_TOP_K = 10
+# Statistics indexes kept in memory, keyed by dataset fingerprint
+STATS_CACHE_MAX_ENTRIES = 16
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+# --- Index ---
+
+def _top_values(series: pd.Series) -> list:
+    try:
+        counts = series.value_counts().head(STATS_TOP_K)
+    except TypeError: # Unhashable values such as lists
+        return []
+    return [(value, int(count)) for value, count in counts.items()]
+
+def build_stats_index(df: pd.DataFrame) -> dict:
+    """Computes per-column statistics for the whole DataFrame in a few vectorized passes.
+
+    Returns {"rows", "columns", "stats"} where `stats[column]` holds count,
+    nulls, distinct, top values and, where they apply, min/max/mean/median/
+    std/sum and quartiles.
+    """
+    counts = df.count()
+    stats = {}
+    for column in df.columns:
+        try:
+            distinct = int(df[column].nunique())
+        except TypeError:
+            distinct = None
+        stats[column] = {
+            "dtype": str(df[column].dtype),
+            "count": int(counts[column]),
+            "nulls": int(len(df) - counts[column]),
+            "distinct": distinct,
+            "top": [] if pd.api.types.is_float_dtype(df[column]) else _top_values(df[column]),
+        }
+
+    numeric = df.select_dtypes(include="number").select_dtypes(exclude="bool")
+    if not numeric.empty:
+        aggregates = numeric.agg(["min", "max", "mean", "std", "sum"])
+        quantiles = numeric.quantile([0.25, 0.5, 0.75])
+        for column in numeric.columns:
+            stats[column].update({name: aggregates.at[name, column] for name in aggregates.index})
+            stats[column].update({
+                "q25": quantiles.at[0.25, column],
+                "median": quantiles.at[0.5, column],
+                "q75": quantiles.at[0.75, column],
+            })
+    for column in df.select_dtypes(include="datetime").columns:
+        stats[column].update({"min": df[column].min(), "max": df[column].max()})
+    return {"rows": len(df), "columns": list(df.columns), "stats": stats}
+
+def stats_index_for(fingerprint: str, df: pd.DataFrame) -> dict:
+    """Returns the dataset's statistics index, building it on first use."""
+    with _indexes_lock:
+        if fingerprint in _indexes:
+            _indexes.move_to_end(fingerprint)
+            return _indexes[fingerprint]
+    index = build_stats_index(df)
+    with _indexes_lock:
+        _indexes[fingerprint] = index
+        if len(_indexes) > STATS_CACHE_MAX_ENTRIES:
+            _indexes.popitem(last=False)
+    print(f"--- Column Statistics Indexed for Dataset {fingerprint} ---")
+    return index
+
+# --- Fast-Path Router ---
+# Only questions that match one of the templates below in full are answered
+# here; any extra word (a filter, a year, a value, "top 10"...) sends the
+# question to the graph, where generated code can honour it.
+
+STAT_TERMS = {
+    "mean": ("mean", "average", "avg"),
+    "sum": ("sum", "total"),
+    "min": ("min", "minimum", "lowest", "smallest"),
+    "max": ("max", "maximum", "highest", "largest", "biggest"),
+    "median": ("median",),
+    "std": ("std", "standard deviation"),
+}
+STAT_LABELS = {
+    "mean": "average", "sum": "total", "min": "minimum", "max": "maximum",
+    "median": "median", "std": "standard deviation",
+}
+_TERM_TO_STAT = {term: stat for stat, terms in STAT_TERMS.items() for term in terms}
+
+_ASK = r"(?:please )?(?:(?:what is|what s|whats|what are|show(?: me)?|give me|tell me|find|get|calculate|compute|list) )?"
+_THE = r"(?:the )?"
+_DATA = r"(?:the |this )?(?:dataset|data|table|file|dataframe|df)"
+_COLUMN_NOUN = r"(?: (?:column|field|variable))?"
+_COL = _THE + r"(?P<col>{columns})" + _COLUMN_NOUN
+_NULLS = r"(?:missing|null|nan|empty)"
+_DISTINCT = r"(?:distinct|unique)"
+
+# (answer kind, template); {stat} and {columns} are filled in per dataset
+_TEMPLATES = [
+    ("stat", _ASK + _THE + r"(?P<stat>{stat}) (?:value )?(?:(?:of|for|in) )?" + _COL),
+    ("stat", _ASK + _COL + r" (?P<stat>{stat})"),
+    ("nulls", r"(?:how many|" + _ASK + _THE + r"number of|count(?: the)?) " + _NULLS
+        + r" (?:values )?(?:are (?:there )?)?(?:in|of) " + _COL),
+    ("nulls", r"how many " + _NULLS + r" values does " + _COL + r" (?:have|contain)"),
+    ("nulls", r"(?:does|do) " + _COL + r" (?:have|contain) (?:any )?" + _NULLS + r" values"),
+    ("distinct_count", r"(?:how many|" + _ASK + _THE + r"number of|count(?: the)?) " + _DISTINCT
+        + r" (?:values )?(?:are (?:there )?)?(?:in|of) " + _COL),
+    ("distinct_count", r"how many " + _DISTINCT + r" values does " + _COL + r" (?:have|contain)"),
+    ("distinct_values", _ASK + _THE + _DISTINCT + r" values (?:of|in) " + _COL),
+    ("top", _ASK + _THE + r"(?:most common|most frequent|top) values? (?:of|in) " + _COL),
+    ("top", _ASK + _THE + r"mode of " + _COL),
+    ("rows", r"how many (?:rows|records|entries|observations)(?: are there)?(?: (?:in|does) " + _DATA + r")?(?: have)?"),
+    ("rows", _ASK + _THE + r"(?:number of (?:rows|records|entries|observations)|row count)(?: (?:in|of) " + _DATA + r")?"),
+    ("columns", r"how many columns(?: are there)?(?: (?:in|does) " + _DATA + r")?(?: have)?"),
+    ("columns", _ASK + _THE + r"(?:number of columns|column count|column names)(?: (?:in|of) " + _DATA + r")?"),
+    ("columns", _ASK + r"(?:the |all )?columns(?: (?:in|of) " + _DATA + r")?"),
+    ("columns", r"what columns are (?:there|in " + _DATA + r")"),
+    ("all_nulls", r"(?:how many|" + _ASK + _THE + r"number of) " + _NULLS
+        + r" values(?: are(?: there)?)?(?: (?:in|per) (?:each column|" + _DATA + r"))?"),
+    ("all_nulls", r"are there (?:any )?" + _NULLS + r" values(?: in " + _DATA + r")?"),
+    ("describe", r"(?:describe|summari[sz]e)(?: " + _DATA + r")?"),
+    ("describe", _ASK + _THE + r"summary statistics(?: (?:of|for) " + _DATA + r")?"),
+]
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[\s_]+", " ", re.sub(r"[^\w\s]", " ", str(text).lower())).strip()
+
+@lru_cache(maxsize=STATS_CACHE_MAX_ENTRIES)
+def _compiled_templates(normalized_columns: tuple) -> list:
+    """The templates with this dataset's column names filled in."""
+    stat = "|".join(re.escape(term) for term in sorted(_TERM_TO_STAT, key=len, reverse=True))
+    # Longest names first so "unit price" is not read as "unit"; a dataset
+    # without usable column names only gets the whole-dataset templates
+    columns = "|".join(re.escape(name) for name in sorted(normalized_columns, key=len, reverse=True)) or r"(?!x)x"
+    return [(kind, re.compile(template.format(stat=stat, columns=columns))) for kind, template in _TEMPLATES]
+
+def _match_template(text: str, columns: list):
+    """Returns (kind, column, stat) for the first template the whole question matches, or None."""
+    by_name = {}
+    for column in columns:
+        by_name.setdefault(_normalize(column), []).append(column)
+    names = tuple(name for name, matches in by_name.items() if name and len(matches) == 1)
+    for kind, pattern in _compiled_templates(names):
+        match = pattern.fullmatch(text)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        column = by_name[groups["col"]][0] if groups.get("col") else None
+        stat = _TERM_TO_STAT[groups["stat"]] if groups.get("stat") else None
+        return kind, column, stat
+    return None
+
+def _format(value) -> str:
+    if isinstance(value, (int, np.integer)):
+        return f"{int(value):,}"
+    if isinstance(value, (float, np.floating)):
+        return f"{float(value):,.4f}".rstrip("0").rstrip(".")
+    return str(value)
+
+def _text(content: str) -> dict:
+    return {"type": "string", "content": content, "follow_up_questions": []}
+
+def _table(df: pd.DataFrame) -> dict:
+    return {
+        "type": "dataframe",
+        "content": {"type": "dataframe", "data": df, "total_rows": len(df)},
+        "follow_up_questions": [],
+    }
+
+def answer_from_stats(index: dict, prompt: str):
+    """Answers a trivial question (row count, a column's mean, nulls, distinct values...)
+    straight from the statistics index.
+
+    Returns a response in the agent's format, or None when the question needs
+    generated code.
+    """
+    if not FAST_PATH_ENABLED or index is None:
+        return None
+    matched = _match_template(_normalize(prompt), index["columns"])
+    if matched is None:
+        return None
+    kind, column, stat = matched
+
+    if kind == "rows":
+        return _text(f"The dataset has {index['rows']:,} rows.")
+    if kind == "columns":
+        names = ", ".join(f"`{name}`" for name in index["columns"])
+        return _text(f"The dataset has {len(index['columns'])} columns: {names}.")
+    if kind == "all_nulls":
+        return _table(pd.DataFrame(
+            {"column": list(index["stats"]), "missing": [s["nulls"] for s in index["stats"].values()]}
+        ))
+    if kind == "describe":
+        return _table(pd.DataFrame(
+            {name: {key: value for key, value in s.items() if key != "top"} for name, s in index["stats"].items()}
+        ))
+
+    column_stats = index["stats"][column]
+    if kind == "nulls":
+        return _text(f"`{column}` has {column_stats['nulls']:,} missing values out of {index['rows']:,} rows.")
+    if kind == "distinct_count":
+        if column_stats["distinct"] is None:
+            return None
+        return _text(f"`{column}` has {column_stats['distinct']:,} distinct values.")
+    if kind == "distinct_values":
+        # Only answer with a list when the top values cover every distinct value
+        if column_stats["distinct"] is None or column_stats["distinct"] > len(column_stats["top"]):
+            return None
+        return _table(pd.DataFrame(column_stats["top"], columns=[column, "count"]))
+    if kind == "top":
+        if not column_stats["top"]:
+            return None
+        return _table(pd.DataFrame(column_stats["top"], columns=[column, "count"]))
+    if stat not in column_stats or pd.isna(column_stats[stat]):
+        return None
+    return _text(f"The {STAT_LABELS[stat]} of `{column}` is {_format(column_stats[stat])}.")
@@ -1,29 +1,225 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 import pandas as pd
 import streamlit as st
-from ydata_profiling import ProfileReport
+
+from out_of_core import OUT_OF_CORE_MB, OUT_OF_CORE_DIR, OutOfCoreDataset, copy_with_fingerprint
+from data_loading import optimize_frame, read_csv
+from query_cache import CACHE_DIR
+
+# Parsed Excel sheets are also written here as Parquet so reopening them skips parsing
+EXCEL_SHEET_CACHE = os.getenv("DATASENSE_EXCEL_SHEET_CACHE", "1") != "0"
+EXCEL_CACHE_DIR = os.path.join(CACHE_DIR, "excel_sheets")
+# `attrs` key holding a cached sheet's column labels when Parquet cannot store them as they are
+SHEET_COLUMNS_ATTR = "datasense_columns"
+
+# CSVs in this directory can be opened in place, for files too large to upload; unset disables it
+SERVER_DATA_DIR = os.getenv("DATASENSE_SERVER_DATA_DIR")
+
+# Fast profiles cover at most this many rows, sampled across a categorical column's values
+PROFILE_SAMPLE_ROWS = int(os.getenv("DATASENSE_PROFILE_SAMPLE_ROWS", "50000"))
+# Columns with at most this many distinct values can stratify the profile sample
+PROFILE_STRATA_MAX = 50
+PROFILE_DIR = os.path.join(CACHE_DIR, "profiles")
+
+# Converts parsed sheets to Parquet off the request path
+_sheet_cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="datasense-sheets")
+_sheets_converting = set()
+_sheets_lock = threading.Lock()
+# Builds profile reports without blocking the Streamlit script
+_profile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="datasense-profile")
+_profile_jobs = {}
+_profile_lock = threading.Lock()
 
 @st.cache_data(show_spinner="Loading data...")
-def load_data(uploaded_file):
-    """Loads data from a CSV or Excel file, handling multiple sheets."""
+def load_data(uploaded_file, optimize: bool = True, use_pyarrow: bool = False):
+    """Loads data from a CSV file.
+
+    With `optimize`, column types are inferred from a sample and numbers,
+    dates and low-cardinality strings are stored compactly; the memory saved
+    is recorded in the DataFrame's `attrs["memory_report"]`. `use_pyarrow`
+    reads CSVs with the pyarrow engine into Arrow-backed dtypes. Excel files
+    are loaded one sheet at a time with `list_excel_sheets` and `load_excel_sheet`.
+    """
     try:
         if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
+            df = read_csv(uploaded_file, optimize, use_pyarrow)
             return {"data": df}
-        elif uploaded_file.name.endswith(('.xls', '.xlsx')):
-            xls = pd.ExcelFile(uploaded_file)
-            sheet_names = xls.sheet_names
-            if not sheet_names:
-                st.error("Excel file contains no sheets.")
-                return None
-            return {sheet: pd.read_excel(xls, sheet) for sheet in sheet_names}
+        st.error("Unsupported file type for load_data.")
+        return None
     except Exception as e:
         st.error(f"Error loading file: {e}")
         return None
 
+# --- Excel ---
+
+def _sheet_dimensions_xlsx(uploaded_file) -> list:
+    """Reads sheet sizes from each worksheet's <dimension> tag without parsing cells."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(uploaded_file, read_only=True)
+    try:
+        sheets = []
+        for worksheet in workbook.worksheets:
+            rows, columns = worksheet.max_row, worksheet.max_column
+            sheets.append({
+                "name": worksheet.title,
+                # The first row holds the header
+                "rows": max(rows - 1, 0) if rows else None,
+                "columns": columns,
+            })
+        return sheets
+    finally:
+        workbook.close()
+
+@st.cache_data(show_spinner="Reading workbook...")
+def list_excel_sheets(uploaded_file) -> list:
+    """Lists a workbook's sheets as {"name", "rows", "columns"} without loading their data.
+
+    Sizes come from workbook metadata and are None when the file does not record them.
+    """
+    try:
+        if uploaded_file.name.endswith('.xlsx'):
+            try:
+                return _sheet_dimensions_xlsx(uploaded_file)
+            finally:
+                uploaded_file.seek(0)
+        xls = pd.ExcelFile(uploaded_file)
+        return [{"name": sheet, "rows": None, "columns": None} for sheet in xls.sheet_names]
+    except Exception as e:
+        st.error(f"Error reading workbook: {e}")
+        return []
+
+def _sheet_cache_path(file_hash: str, sheet_name: str, optimize: bool) -> str:
+    # "v2": sheets cached before column labels were preserved are not reused
+    sheet_key = hashlib.sha256(f"{sheet_name}:{optimize}:v2".encode("utf-8")).hexdigest()[:12]
+    return os.path.join(EXCEL_CACHE_DIR, f"{file_hash}_{sheet_key}.parquet")
+
+def _write_sheet_cache(df: pd.DataFrame, path: str):
+    """Writes a parsed sheet to Parquet atomically; sheets Parquet cannot type are skipped.
+
+    Labels Parquet cannot hold (numbers, duplicates) are written as positions,
+    with the originals kept in `attrs` for `_read_sheet_cache` to restore.
+    """
+    try:
+        os.makedirs(EXCEL_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        table = df
+        if not all(isinstance(column, str) for column in df.columns) or not df.columns.is_unique:
+            table = df.set_axis([str(i) for i in range(df.shape[1])], axis=1)
+            table.attrs = {**df.attrs, SHEET_COLUMNS_ATTR: list(df.columns)}
+        table.to_parquet(tmp_path, engine="pyarrow", compression="zstd")
+        os.replace(tmp_path, path)
+        print(f"--- Cached Excel Sheet: {path} ---")
+    except Exception as e:
+        print(f"--- Excel Sheet Cache Failed: {e} ---")
+    finally:
+        with _sheets_lock:
+            _sheets_converting.discard(path)
+
+def _read_sheet_cache(path: str) -> pd.DataFrame:
+    # The memory report travels in the Parquet metadata along with the dtypes
+    df = pd.read_parquet(path, engine="pyarrow")
+    labels = df.attrs.pop(SHEET_COLUMNS_ATTR, None)
+    if labels is not None:
+        # Metadata is JSON, so tuple labels come back as lists
+        df.columns = [tuple(label) if isinstance(label, list) else label for label in labels]
+    return df
+
+@st.cache_data(show_spinner="Loading sheet...")
+def load_excel_sheet(uploaded_file, sheet_name: str, optimize: bool = True):
+    """Parses a single sheet of a workbook, leaving the others untouched.
+
+    The parsed sheet is converted to Parquet in the background so loading it
+    again, even in a later session, reads the columnar copy instead.
+    """
+    try:
+        file_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()[:16]
+        cache_path = _sheet_cache_path(file_hash, sheet_name, optimize)
+        if EXCEL_SHEET_CACHE and os.path.exists(cache_path):
+            return _read_sheet_cache(cache_path)
+        df = pd.read_excel(uploaded_file, sheet_name=sheet_name)
+        if optimize:
+            df = optimize_frame(df)
+        if EXCEL_SHEET_CACHE:
+            with _sheets_lock:
+                start = cache_path not in _sheets_converting
+                _sheets_converting.add(cache_path)
+            if start:
+                _sheet_cache_executor.submit(_write_sheet_cache, df.copy(deep=False), cache_path)
+        return df
+    except Exception as e:
+        st.error(f"Error loading sheet '{sheet_name}': {e}")
+        return None
+
+def needs_out_of_core(uploaded_file) -> bool:
+    """True for CSVs too large to load into pandas comfortably."""
+    return uploaded_file.name.endswith('.csv') and uploaded_file.size > OUT_OF_CORE_MB * 1024 * 1024
+
+@st.cache_resource(show_spinner="Converting large file for out-of-core queries...")
+def load_out_of_core(uploaded_file) -> OutOfCoreDataset:
+    """Streams a large CSV to disk and converts it to Parquet queried by DuckDB.
+
+    The file is never loaded into pandas; only a sample is, for previews.
+    """
+    os.makedirs(OUT_OF_CORE_DIR, exist_ok=True)
+    csv_path = os.path.join(OUT_OF_CORE_DIR, f"upload_{os.getpid()}_{id(uploaded_file)}.csv")
+    try:
+        uploaded_file.seek(0)
+        fingerprint = copy_with_fingerprint(uploaded_file, csv_path)
+        return OutOfCoreDataset.from_csv(csv_path, fingerprint)
+    finally:
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+
+# --- Server Files ---
+# Browser uploads are held in memory and capped by Streamlit's server.maxUploadSize,
+# so datasets larger than RAM have to be read from the server's disk instead
+
+def list_server_files() -> list:
+    """CSV files in DATASENSE_SERVER_DATA_DIR, or [] when it is not configured."""
+    if not SERVER_DATA_DIR or not os.path.isdir(SERVER_DATA_DIR):
+        return []
+    return sorted(name for name in os.listdir(SERVER_DATA_DIR) if name.endswith('.csv'))
+
+def _server_file_path(name: str) -> str:
+    # Only plain file names from list_server_files are accepted, never paths
+    return os.path.join(SERVER_DATA_DIR, os.path.basename(name))
+
+@st.cache_resource(show_spinner="Converting large file for out-of-core queries...")
+def _open_server_out_of_core(name: str, modified: float) -> OutOfCoreDataset:
+    return OutOfCoreDataset.from_csv(_server_file_path(name))
+
+@st.cache_data(show_spinner="Loading data...")
+def _load_server_csv(name: str, modified: float, optimize: bool, use_pyarrow: bool) -> pd.DataFrame:
+    return read_csv(_server_file_path(name), optimize, use_pyarrow)
+
+def open_server_file(name: str, optimize: bool = True, use_pyarrow: bool = False) -> tuple:
+    """Opens a CSV from DATASENSE_SERVER_DATA_DIR without uploading it.
+
+    Returns (df, out-of-core dataset or None); files above
+    DATASENSE_OUT_OF_CORE_MB are converted and queried in place with DuckDB.
+    """
+    try:
+        path = _server_file_path(name)
+        # The modification time is part of the cache key so an edited file is read again
+        modified = os.path.getmtime(path)
+        if os.path.getsize(path) > OUT_OF_CORE_MB * 1024 * 1024:
+            dataset = _open_server_out_of_core(name, modified)
+            return dataset.sample(), dataset
+        return _load_server_csv(name, modified, optimize, use_pyarrow), None
+    except Exception as e:
+        st.error(f"Error loading file: {e}")
+        return None, None
+
+# --- Profiling ---
+
 def generate_eda_report(df: pd.DataFrame):
     """Generates a comprehensive EDA report using ydata-profiling."""
     if df is not None:
         try:
+            from ydata_profiling import ProfileReport
             profile = ProfileReport(df,
                 title="DataSense AI: Data Profile Report",
                 explorative=True,
@@ -34,4 +230,86 @@ def generate_eda_report(df: pd.DataFrame):
         except Exception as e:
             st.error(f"Error generating EDA report: {e}")
             return None
-    return None
\ No newline at end of file
+    return None
+
+def profile_sample(df: pd.DataFrame, rows: int = PROFILE_SAMPLE_ROWS) -> pd.DataFrame:
+    """Samples up to `rows` rows, keeping each value of the lowest-cardinality column represented."""
+    if len(df) <= rows:
+        return df
+    strata = None
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object or pd.api.types.is_bool_dtype(series):
+            distinct = series.nunique(dropna=False)
+            if 1 < distinct <= PROFILE_STRATA_MAX and (strata is None or distinct < strata[1]):
+                strata = (column, distinct)
+    if strata is None:
+        return df.sample(rows, random_state=42).sort_index()
+    groups = df.groupby(strata[0], observed=True, dropna=False)
+    sampled = groups.sample(frac=rows / len(df), random_state=42)
+    # Every value keeps at least one row so rare categories still show up in the report
+    rare = groups.head(1)
+    return pd.concat([sampled, rare[~rare.index.isin(sampled.index)]]).sort_index()
+
+def _profile_path(dataset_hash: str, mode: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{dataset_hash}_{mode}.html")
+
+def cached_profile_html(dataset_hash: str, mode: str = "fast"):
+    """Returns the stored report HTML for a dataset, or None if it has not been built."""
+    path = _profile_path(dataset_hash, mode)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+def build_profile_html(df: pd.DataFrame, dataset_hash: str, mode: str = "fast") -> str:
+    """Builds a profile report and stores its HTML on disk, keyed by dataset hash and mode.
+
+    "fast" profiles a stratified sample with minimal settings; "full" runs the
+    explorative report over every row.
+    """
+    # ydata-profiling takes seconds to import, so it is loaded on the first profile only
+    from ydata_profiling import ProfileReport
+    if mode == "fast":
+        profile_df = profile_sample(df)
+        profile = ProfileReport(profile_df, title="DataSense AI: Data Profile Report", minimal=True, dark_mode=False)
+        if len(profile_df) < len(df):
+            profile.config.title += f" (sample of {len(profile_df):,} / {len(df):,} rows)"
+    else:
+        profile = ProfileReport(df, title="DataSense AI: Data Profile Report", explorative=True, dark_mode=False, minimal=False)
+    html = profile.to_html()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = _profile_path(dataset_hash, mode)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding="utf-8") as f:
+        f.write(html)
+    os.replace(tmp_path, path)
+    print(f"--- Profile Cached: {path} ---")
+    return html
+
+def request_profile(df: pd.DataFrame, dataset_hash: str, mode: str = "fast"):
+    """Returns a Future for a dataset's profile HTML, building it in the background if needed.
+
+    Concurrent requests for the same dataset and mode share one build. Only
+    running builds are tracked; a finished report is read back from disk.
+    """
+    key = (dataset_hash, mode)
+    with _profile_lock:
+        future = _profile_jobs.get(key)
+        if future is not None:
+            return future
+        html = cached_profile_html(dataset_hash, mode)
+        if html is not None:
+            future = Future()
+            future.set_result(html)
+            return future
+        future = _profile_executor.submit(build_profile_html, df, dataset_hash, mode)
+        _profile_jobs[key] = future
+    # Finished jobs hold the whole report; drop them so memory does not grow per dataset
+    future.add_done_callback(lambda done: _forget_profile_job(key, done))
+    return future
+
+def _forget_profile_job(key, future: Future):
+    with _profile_lock:
+        if _profile_jobs.get(key) is future:
+            del _profile_jobs[key]
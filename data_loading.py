@@ -0,0 +1,140 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Loading and dtype optimization shared by the Streamlit app and headless runs;
+# nothing here may import streamlit.
+
+# Rows read up front to infer column types
+SAMPLE_ROWS = 10000
+# String columns whose distinct values are at most this share of rows become categoricals
+CATEGORY_MAX_RATIO = 0.5
+# Share of sampled values that must parse as dates before a column is converted
+DATE_MIN_PARSE_RATIO = 0.95
+# Integer columns become int32 only when every value fits in this bound (the int16 range),
+# so doubling a column or multiplying two such columns still fits in int32
+INT32_SAFE_ABS_MAX = np.iinfo(np.int16).max
+
+def memory_usage_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+def _looks_like_dates(values: pd.Series) -> bool:
+    """True when almost every sampled string parses as a date."""
+    strings = values.dropna().astype(str)
+    if strings.empty or strings.str.contains(r'[-/:]').mean() < DATE_MIN_PARSE_RATIO:
+        return False
+    parsed = pd.to_datetime(strings, errors='coerce', format='mixed')
+    return parsed.notna().mean() >= DATE_MIN_PARSE_RATIO
+
+def _infer_csv_dtypes(sample: pd.DataFrame):
+    """Picks categorical and date columns from a sample of the file."""
+    dtypes, date_columns = {}, []
+    for column in sample.columns:
+        values = sample[column]
+        if values.dtype != object:
+            continue
+        if _looks_like_dates(values):
+            date_columns.append(column)
+        elif values.nunique() <= CATEGORY_MAX_RATIO * max(len(values), 1):
+            dtypes[column] = "category"
+    return dtypes, date_columns
+
+def _downcast_numeric(series: pd.Series):
+    """Returns the column in a smaller dtype that holds every value exactly, or None.
+
+    Floats become float32 when no value changes. Integers become signed int32,
+    and only when their values stay within `INT32_SAFE_ABS_MAX`: generated
+    code does arithmetic on them (`qty * 2`, `qty * price`), and a narrow or
+    unsigned integer that overflows wraps around silently instead of failing.
+    Sums and cumulative sums of int32 are computed in int64 anyway.
+    """
+    if pd.api.types.is_bool_dtype(series) or isinstance(series.dtype, pd.ArrowDtype):
+        return None
+    if pd.api.types.is_integer_dtype(series):
+        if series.dtype.itemsize <= 4 or series.empty or series.isna().all():
+            return None
+        if max(abs(int(series.min())), abs(int(series.max()))) > INT32_SAFE_ABS_MAX:
+            return None
+        # Nullable Int64 columns keep their missing values
+        return series.astype("Int32" if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) else np.int32)
+    if pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+        as_float32 = series.astype(np.float32)
+        # Only downcast when no value changes, so money columns keep their cents
+        if np.array_equal(as_float32.astype(series.dtype).to_numpy(), series.to_numpy(), equal_nan=True):
+            return as_float32
+    return None
+
+def _convert_strings(series: pd.Series):
+    """Parses a string column as dates or encodes it as a categorical, or returns None."""
+    if _looks_like_dates(series.head(SAMPLE_ROWS)):
+        parsed = pd.to_datetime(series, errors='coerce', format='mixed')
+        # Only keep the dates if no value outside the sample failed to parse
+        if parsed.isna().sum() == series.isna().sum():
+            return parsed
+    if series.nunique() <= CATEGORY_MAX_RATIO * max(len(series), 1):
+        return series.astype("category")
+    return None
+
+def optimize_dtypes(df: pd.DataFrame) -> tuple:
+    """Downcasts numbers, parses dates and encodes low-cardinality strings.
+
+    Returns the optimized DataFrame and a {column: "old -> new"} summary.
+    """
+    df = df.copy(deep=False)
+    conversions = {}
+    for column in df.columns:
+        series = df[column]
+        before = str(series.dtype)
+        if pd.api.types.is_numeric_dtype(series):
+            converted = _downcast_numeric(series)
+        elif series.dtype == object:
+            converted = _convert_strings(series)
+        else:
+            converted = None
+        if converted is not None:
+            df[column] = converted
+            conversions[str(column)] = f"{before} -> {converted.dtype}"
+    return df, conversions
+
+def read_csv(uploaded_file, optimize: bool = True, use_pyarrow: bool = False) -> pd.DataFrame:
+    """Reads a CSV from a path or file object.
+
+    With `optimize`, dtypes are inferred from a sample and stored compactly;
+    `use_pyarrow` reads into Arrow-backed dtypes with the pyarrow engine.
+    """
+    if not optimize:
+        return pd.read_csv(uploaded_file)
+
+    sample = pd.read_csv(uploaded_file, nrows=SAMPLE_ROWS)
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+    sample_mb_per_row = memory_usage_mb(sample) / max(len(sample), 1)
+    if use_pyarrow:
+        df = pd.read_csv(uploaded_file, engine="pyarrow", dtype_backend="pyarrow")
+    else:
+        dtypes, date_columns = _infer_csv_dtypes(sample)
+        # Categoricals are decoded while reading, so the object columns never exist in full
+        df = pd.read_csv(uploaded_file, dtype=dtypes, parse_dates=date_columns, date_format="mixed")
+    df, conversions = optimize_dtypes(df)
+    df.attrs["memory_report"] = {
+        "before_mb": sample_mb_per_row * len(df), # estimated from the sample read with default dtypes
+        "after_mb": memory_usage_mb(df),
+        "conversions": conversions,
+    }
+    return df
+
+def optimize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Applies `optimize_dtypes` and records the memory saved in `df.attrs["memory_report"]`."""
+    before_mb = memory_usage_mb(df)
+    df, conversions = optimize_dtypes(df)
+    df.attrs["memory_report"] = {"before_mb": before_mb, "after_mb": memory_usage_mb(df), "conversions": conversions}
+    return df
+
+def read_dataset(path: str, optimize: bool = True, use_pyarrow: bool = False, sheet_name=None) -> pd.DataFrame:
+    """Reads a CSV or one sheet of an Excel file from disk (the first sheet by default)."""
+    if path.endswith('.csv'):
+        return read_csv(path, optimize, use_pyarrow)
+    if path.endswith(('.xls', '.xlsx')):
+        df = pd.read_excel(path, sheet_name=sheet_name or 0)
+        return optimize_frame(df) if optimize else df
+    raise ValueError(f"Unsupported file type: {os.path.basename(path)}")
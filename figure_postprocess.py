@@ -0,0 +1,169 @@
+import os
+import numpy as np
+import plotly.graph_objects as go
+
+# Scatter traces with more points than this are downsampled to about this many
+FIGURE_MAX_POINTS = int(os.getenv("DATASENSE_FIGURE_MAX_POINTS", "5000"))
+# Key under `layout.meta` recording what was downsampled
+DOWNSAMPLE_META_KEY = "datasense_downsampled"
+
+# Trace properties holding point indices rather than per-point values
+_INDEX_KEYS = ("selectedpoints",)
+# Scatter features that WebGL traces do not render the same way
+_SVG_ONLY_KEYS = ("stackgroup", "fill")
+
+# --- Downsampling ---
+
+def _as_numeric(values):
+    """Values as float64 for distance and area maths, or None for non-numeric data."""
+    array = np.asarray(values)
+    if np.issubdtype(array.dtype, np.datetime64):
+        return array.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    try:
+        return array.astype(np.float64)
+    except (TypeError, ValueError):
+        return None
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: picks `threshold` points that keep a line's visual shape.
+
+    Each bucket's triangle areas are computed in one vectorized step; NaN
+    points are never chosen unless a bucket has nothing else.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # threshold - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        next_start, next_end = edges[bucket + 1], edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = np.nanmean(x[next_start:max(next_end, next_start + 1)])
+        next_y = np.nanmean(y[next_start:max(next_end, next_start + 1)])
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(np.nan_to_num(areas, nan=-1.0)))
+        selected[bucket + 1] = previous
+    return selected
+
+def grid_bin_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Keeps one point per occupied cell of a grid over the plot area.
+
+    Dense regions collapse to their outline while outliers survive, which is
+    what a scatter plot's reader sees anyway.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    cells_per_axis = max(int(np.sqrt(threshold)), 1)
+
+    def _cell(values):
+        finite = np.isfinite(values)
+        low, high = (np.min(values[finite]), np.max(values[finite])) if finite.any() else (0.0, 1.0)
+        scaled = (values - low) / ((high - low) or 1.0) * (cells_per_axis - 1)
+        return np.where(finite, np.round(scaled), -1).astype(np.int64)
+
+    cells = _cell(x) * (cells_per_axis + 1) + _cell(y)
+    _, first = np.unique(cells, return_index=True)
+    return np.sort(first)
+
+def _stride_indices(n: int, threshold: int) -> np.ndarray:
+    return np.unique(np.linspace(0, n - 1, threshold).astype(np.int64))
+
+# --- Figures ---
+
+def _take(values, indices: np.ndarray, n: int):
+    """Subsets a per-point array; scalars and arrays of another length are left alone.
+
+    Nested objects (`marker`, `marker.line`, `error_y`...) are subset the same way,
+    so every array with one entry per point stays aligned with x and y.
+    """
+    if isinstance(values, dict):
+        return {key: _take(value, indices, n) for key, value in values.items()}
+    if values is None or isinstance(values, str) or not hasattr(values, "__len__") or len(values) != n:
+        return values
+    if isinstance(values, np.ndarray):
+        return values[indices]
+    return [values[i] for i in indices] # Lists may be ragged, e.g. customdata rows
+
+def _remap_points(selected, indices: np.ndarray):
+    """Positions within the kept points of the originally selected ones."""
+    if selected is None or isinstance(selected, (bool, str)) or not hasattr(selected, "__len__"):
+        return selected
+    return np.flatnonzero(np.isin(indices, np.asarray(selected, dtype=np.int64)))
+
+def _downsample_trace(trace: dict, max_points: int):
+    """Returns (new trace dict, record) for an oversized scatter trace, or (trace, None)."""
+    y = trace.get("y")
+    if y is None or len(y) <= max_points:
+        return trace, None
+    n = len(y)
+    trace = dict(trace)
+    if trace.get("x") is None:
+        # An implicit x axis must become explicit once points are dropped
+        try:
+            trace["x"] = trace.pop("x0", 0) + np.arange(n) * trace.pop("dx", 1)
+        except TypeError: # A date or category x0
+            return trace, None
+
+    x_numeric, y_numeric = _as_numeric(trace["x"]), _as_numeric(y)
+    mode = trace.get("mode") or "lines"
+    if x_numeric is None or y_numeric is None:
+        method, indices = "stride", _stride_indices(n, max_points)
+    elif "lines" in mode:
+        method, indices = "lttb", lttb_indices(x_numeric, y_numeric, max_points)
+    else:
+        method, indices = "grid", grid_bin_indices(x_numeric, y_numeric, max_points)
+
+    trace = {key: _remap_points(value, indices) if key in _INDEX_KEYS else _take(value, indices, n)
+             for key, value in trace.items()}
+    return trace, {"method": method, "points": n, "kept": int(len(indices))}
+
+def downsample_figure(fig: go.Figure, max_points: int = FIGURE_MAX_POINTS) -> go.Figure:
+    """Downsamples oversized scatter traces and moves them to WebGL (`Scattergl`).
+
+    Lines use LTTB and marker-only scatters use grid binning. Figures without
+    such traces are returned unchanged; otherwise a new figure is returned
+    whose `layout.meta` lists what was reduced. A `layout.meta` the figure
+    already sets to something other than a dict is left as it is, since
+    hover templates index into it, and the figure then carries no record.
+    """
+    if not isinstance(fig, go.Figure) or max_points <= 0:
+        return fig
+    traces, records = [], []
+    for i, trace in enumerate(fig.data):
+        if trace.type not in ("scatter", "scattergl"):
+            traces.append(trace)
+            continue
+        data, record = _downsample_trace(trace.to_plotly_json(), max_points)
+        if record is None:
+            traces.append(trace)
+            continue
+        data.pop("type", None)
+        webgl = not any(data.get(key) not in (None, "none") for key in _SVG_ONLY_KEYS)
+        # Scattergl lacks a few SVG-only properties (e.g. spline lines); those are dropped
+        traces.append(go.Scattergl(data, skip_invalid=True) if webgl else go.Scatter(data))
+        records.append({"trace": i, **record, "webgl": isinstance(traces[-1], go.Scattergl)})
+
+    if not records:
+        return fig
+    downsampled = go.Figure(data=traces, layout=fig.layout, frames=fig.frames)
+    meta = downsampled.layout.meta
+    if meta is None or isinstance(meta, dict):
+        downsampled.update_layout(meta={**(meta or {}), DOWNSAMPLE_META_KEY: records})
+    print(f"--- Figure Downsampled: {records} ---")
+    return downsampled
+
+def downsample_summary(fig) -> str:
+    """A short note such as "Showing 5,000 of 1,000,000 points", or "" if nothing was reduced."""
+    meta = getattr(getattr(fig, "layout", None), "meta", None)
+    records = meta.get(DOWNSAMPLE_META_KEY) if isinstance(meta, dict) else None
+    if not records:
+        return ""
+    kept, points = sum(r["kept"] for r in records), sum(r["points"] for r in records)
+    return f"Showing {kept:,} of {points:,} points (downsampled for display)."
@@ -1,42 +1,62 @@
 import os
+import re
 import json
+import time
+import hashlib
+import threading
+import uuid
+import queue
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypedDict, Annotated, List
 from operator import itemgetter
 import pandas as pd
 import plotly.graph_objects as go
-from asteval import Interpreter
-from dotenv import load_dotenv
-
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.graph import StateGraph, END
-
-# --- Load API Key ---
-load_dotenv()
-if "GOOGLE_API_KEY" not in os.environ:
-    raise ValueError("GOOGLE_API_KEY not found in .env file. Please add it.")
+from sandbox import sandbox_session, execute_code, release_session
+from query_cache import QUERY_CACHE, SEMANTIC_CACHE
+from llm_client import get_llm_client
+from tracing import TRACER, current_trace_id
+from column_stats import stats_index_for, answer_from_stats
+from prompt_context import prompt_context_for
+from figure_postprocess import downsample_figure
+from out_of_core import SQL_MAX_ROWS
 
 # --- 1. Define Agent State ---
 class AgentState(TypedDict):
-    df_preview: str
+    session_id: str
+    trace_id: str
+    engine: str
+    data_context: str
     user_prompt: str
     code_solution: str
     execution_result: any
     error_message: str
     retries: int
+    result_summary: str
     final_response: dict
 
 # --- 2. Define Tools / Nodes ---
 
-# Use a shared, safe interpreter for code execution
-aeval = Interpreter()
-aeval.symtable['pd'] = pd
-aeval.symtable['go'] = go
+# Event queues of streaming queries, keyed by trace id (nodes may run on other threads)
+_stream_sinks = {}
+_stream_lock = threading.Lock()
+
+def _token_sink(state: AgentState):
+    """Returns a callback forwarding LLM tokens to the query's stream, or None if not streaming."""
+    with _stream_lock:
+        events = _stream_sinks.get(state.get('trace_id'))
+    if events is None:
+        return None
+    return lambda text: events.put({"type": "token", "text": text})
+
+# Larger tabular results are truncated to this many rows before they reach the chat
+RESULT_MAX_ROWS = int(os.getenv("DATASENSE_RESULT_MAX_ROWS", "50000"))
 
 def route_intent_node(state: AgentState):
     """Classifies user intent to decide the next step."""
     prompt = f"""Given the user's query, classify its primary intent.
-    The dataframe `df` is already loaded. Its preview is:
-    {state['df_preview']}
+    The dataframe `df` is already loaded. Its columns are:
+    {state['data_context']}
 
     User Query: "{state['user_prompt']}"
 
@@ -47,8 +67,7 @@ def route_intent_node(state: AgentState):
 
     Respond with ONLY ONE of the intent names: 'plot', 'dashboard', or 'general_query'.
     """
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0)
-    intent = llm.invoke(prompt).content.strip()
+    intent = get_llm_client().invoke(prompt, temperature=0).strip()
     
     print(f"--- Intent Routed to: {intent} ---")
     return intent
@@ -57,17 +76,36 @@ def route_intent_node(state: AgentState):
 
 # In llm_agent.py, replace the entire code_generator_node function with this:
 
+# How generated code reaches the data, per execution engine
+DATA_ACCESS = {
+    "pandas": {
+        "subject": "using a pandas DataFrame named `df`",
+        "variables": "The variables `df` (the DataFrame), `pd` (pandas), and `go` (plotly.graph_objects) are ALREADY AVAILABLE.",
+    },
+    "duckdb": {
+        "subject": "over a dataset too large for memory, stored in a DuckDB table named `data`",
+        "variables": (
+            "The functions/variables `sql`, `df_sample`, `pd` (pandas) and `go` (plotly.graph_objects) are ALREADY AVAILABLE. "
+            "There is NO `df`. Call `sql(\"SELECT ... FROM data ...\")` with a single DuckDB SELECT; it returns a pandas DataFrame. "
+            "Aggregate, filter and limit inside the SQL so only small results come back; "
+            f"a query returning more than {SQL_MAX_ROWS:,} rows raises an error. "
+            "`df_sample` is a small random sample for reference only - never compute answers from it."
+        ),
+    },
+}
+
 def code_generator_node(state: AgentState):
     """Generates Python code to answer the user's question."""
+    data_access = DATA_ACCESS[state.get('engine') or "pandas"]
     prompt_template = """You are an expert Python data scientist.
-    Your sole task is to generate a Python code snippet to answer the user's question using a pandas DataFrame named `df`.
-    The DataFrame preview is:
-    {df_preview}
+    Your sole task is to generate a Python code snippet to answer the user's question {data_subject}.
+    The dataset (column (dtype): null rate; value range or example values):
+    {data_context}
 
     User Question: {user_prompt}
 
     **CRITICAL Instructions:**
-    1.  The variables `df` (the DataFrame), `pd` (pandas), and `go` (plotly.graph_objects) are ALREADY AVAILABLE.
+    1.  {data_variables}
     2.  **DO NOT include `import pandas as pd` or `import plotly.graph_objects as go` in your code.**
     3.  Your code must be a single expression that can be evaluated. It should not include any print statements.
     4.  For plots, you MUST return a single `go.Figure` object.
@@ -83,27 +121,31 @@ def code_generator_node(state: AgentState):
 
     Respond ONLY with the Python code snippet.
     """
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0)
-
     prompt = prompt_template.format(
-        df_preview=state['df_preview'],
+        data_subject=data_access["subject"],
+        data_variables=data_access["variables"],
+        data_context=state['data_context'],
         user_prompt=state['user_prompt'],
         previous_code=state.get('code_solution', 'N/A'),
         error=state.get('error_message', 'N/A')
     )
 
-    response = llm.invoke(prompt)
-    code = response.content.strip().replace("```python", "").replace("```", "")
+    response = get_llm_client().invoke(prompt, temperature=0, on_token=_token_sink(state))
+    code = response.strip().replace("```python", "").replace("```", "")
     print(f"--- Generated Code ---\n{code}\n--------------------")
 
     return {"code_solution": code, "error_message": None} # Reset error message
 def code_executor_node(state: AgentState):
-    """Executes the generated code in a safe sandbox."""
+    """Executes the generated code in the session's own sandbox.
+
+    Time and memory limits of the process backend surface as an error_message,
+    so an overrun is retried like any other failure.
+    """
     code = state['code_solution']
     retries = state.get('retries', 0)
     
     try:
-        result = aeval.eval(code)
+        result = execute_code(state['session_id'], code)
         print(f"--- Code Execution Successful ---")
         return {"execution_result": result, "retries": retries}
     except Exception as e:
@@ -111,6 +153,21 @@ def code_executor_node(state: AgentState):
         print(f"--- Code Execution Failed ---\n{error_msg}\n--------------------")
         return {"error_message": error_msg, "execution_result": None, "retries": retries + 1}
 
+def figure_postprocessor_node(state: AgentState):
+    """Downsamples oversized scatter traces so figures stay light to render, save and export.
+
+    Always writes `execution_result` back, since LangGraph rejects a node
+    update that writes no state key.
+    """
+    result = state.get('execution_result')
+    if state.get("error_message"):
+        return {"execution_result": result}
+    if isinstance(result, go.Figure):
+        return {"execution_result": downsample_figure(result)}
+    if isinstance(result, list) and result and all(isinstance(item, go.Figure) for item in result):
+        return {"execution_result": [downsample_figure(fig) for fig in result]}
+    return {"execution_result": result}
+
 # In llm_agent.py, replace the entire response_formatter_node function with this:
 
 # In llm_agent.py, replace the entire response_formatter_node function with this:
@@ -118,9 +175,8 @@ def code_executor_node(state: AgentState):
 # In llm_agent.py, replace the entire response_formatter_node function with this final version:
 
 def response_formatter_node(state: AgentState):
-    """Formats the final response and generates follow-up questions."""
+    """Formats the final response; follow-up questions are generated afterwards."""
     result = state['execution_result']
-    user_prompt = state['user_prompt']
     error_message = state.get("error_message")
 
     final_output = {"follow_up_questions": []}
@@ -130,6 +186,7 @@ def response_formatter_node(state: AgentState):
     if error_message:
         final_output["type"] = "string"
         final_output["content"] = f"I encountered an error trying to process your request. The error was: {error_message}"
+        final_output["error"] = error_message
         summary_for_llm = f"an error: {error_message}"
     
     # --- If no error, process the successful result ---
@@ -141,101 +198,513 @@ def response_formatter_node(state: AgentState):
         final_output["type"] = "dashboard"
         final_output["content"] = result
         summary_for_llm = f"a dashboard with {len(result)} charts"
-    elif isinstance(result, pd.DataFrame):
-        final_output["type"] = "string"
-        final_output["content"] = result.to_string()
-        summary_for_llm = f"a dataframe with shape {result.shape}"
+    elif isinstance(result, (pd.DataFrame, pd.Series)):
+        table = result.to_frame() if isinstance(result, pd.Series) else result
+        # Tables stay typed so the UI can page through them instead of rendering one huge string
+        final_output["type"] = "dataframe"
+        final_output["content"] = {
+            "type": "dataframe",
+            "data": table.head(RESULT_MAX_ROWS),
+            "total_rows": len(table)
+        }
+        summary_for_llm = f"a dataframe with shape {table.shape}"
     else: # Handle numbers, strings, etc.
         final_output["type"] = "string"
         final_output["content"] = str(result)
         summary_for_llm = str(result)
         
-    # --- Generate follow-up questions only on success ---
-    if not error_message:
-        prompt = f"""The user asked: "{user_prompt}"
-        The analysis produced the following result: {summary_for_llm}.
-        
-        Based on this, generate three relevant, insightful follow-up questions.
-        Provide the output as a JSON object with a single key: "follow_up_questions".
-        Respond ONLY with the JSON object.
-        """
-        try:
-            llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.5)
-            response_text = llm.invoke(prompt).content.strip().replace("```json", "").replace("```", "")
-            response_json = json.loads(response_text)
-            final_output["follow_up_questions"] = response_json.get("follow_up_questions", [])
-        except Exception:
-            # If JSON parsing or LLM call fails, just return no follow-ups
-            final_output["follow_up_questions"] = []
-
     print(f"--- Final Response Formatted ---")
-    return {"final_response": final_output}
+    return {"final_response": final_output, "result_summary": summary_for_llm}
+
+# Follow-ups are a separate LLM round-trip, so they run off the request path
+_follow_up_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="follow-ups")
+
+def generate_follow_up_questions(user_prompt: str, result_summary: str) -> list:
+    """Asks the LLM for three follow-up questions about a successful result."""
+    prompt = f"""The user asked: "{user_prompt}"
+    The analysis produced the following result: {result_summary}.
+    
+    Based on this, generate three relevant, insightful follow-up questions.
+    Provide the output as a JSON object with a single key: "follow_up_questions".
+    Respond ONLY with the JSON object.
+    """
+    try:
+        response_text = get_llm_client().invoke(prompt, temperature=0.5).strip().replace("```json", "").replace("```", "")
+        response_json = json.loads(response_text)
+        return response_json.get("follow_up_questions", [])
+    except Exception:
+        # If JSON parsing or LLM call fails, just return no follow-ups
+        return []
+
+def resolve_follow_ups(response: dict, timeout: float = None) -> list:
+    """Waits for a response's background follow-up questions and returns them."""
+    future = response.get("follow_up_future")
+    if future is not None:
+        response["follow_up_questions"] = future.result(timeout=timeout)
+    return response.get("follow_up_questions", [])
+
+# Dashboards are planned first, then each chart is generated and executed on its own
+DASHBOARD_WORKERS = int(os.getenv("DATASENSE_DASHBOARD_WORKERS", "4"))
+DASHBOARD_MAX_CHARTS = 6
+_DASHBOARD_REQUEST = re.compile(r"\bdashboards?\b", re.IGNORECASE)
+_dashboard_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+
+def plan_dashboard(user_prompt: str, data_context: str) -> list:
+    """Asks the LLM for a short description of each chart the dashboard should contain."""
+    prompt = f"""The user asked for a dashboard: "{user_prompt}"
+    The dataset:
+    {data_context}
+
+    Plan at most {DASHBOARD_MAX_CHARTS} charts that together answer the request, each a single Plotly figure.
+    Provide the output as a JSON object with a single key "charts" holding one sentence per chart,
+    naming the chart type and the columns it uses.
+    Respond ONLY with the JSON object.
+    """
+    try:
+        response_text = get_llm_client().invoke(prompt, temperature=0).strip().replace("```json", "").replace("```", "")
+        charts = json.loads(response_text).get("charts", [])
+        return [str(chart) for chart in charts if str(chart).strip()][:DASHBOARD_MAX_CHARTS]
+    except Exception:
+        # Without a plan the dashboard is generated as one expression instead
+        return []
+
+class DashboardJob:
+    """A dashboard whose charts are built concurrently.
+
+    `figures[i]` fills in as chart `i` finishes; a chart that still fails after
+    its retries leaves its figure as None and its reason in `errors[i]`.
+    """
+    def __init__(self, specs: list):
+        self.specs = specs
+        self.figures = [None] * len(specs)
+        self.errors = [None] * len(specs)
+        self.futures = []
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    def completed(self) -> list:
+        return [fig for fig in self.figures if fig is not None]
+
+    def result(self, timeout: float = None) -> list:
+        """Waits for every chart and returns the figures that were built."""
+        for future in self.futures:
+            future.result(timeout=timeout)
+        return self.completed()
+
 # --- 3. Define Graph Logic ---
+def route_entry(state: AgentState):
+    """Skips code generation when reusable code was found for the prompt."""
+    if state.get("code_solution"):
+        print("--- Decision: Reuse Cached Code ---")
+        return "execute"
+    return "generate"
+
+# Code generation attempts after the first one fails
+MAX_CODE_RETRIES = 2
+
 def should_retry(state: AgentState):
     """Determines if the agent should retry code generation after an error."""
-    if state.get("error_message") and state.get('retries', 0) < 2:
+    if state.get("error_message") and state.get('retries', 0) < MAX_CODE_RETRIES:
         print("--- Decision: Retry Code Generation ---")
         return "retry"
     print("--- Decision: End and Format Response ---")
     return "end"
 
 # --- 4. Main Agent Class ---
+# Callbacks of the form callback(node_name, seconds, state_update), run after every node
+NODE_OBSERVERS = []
+
+def _describe_update(update: dict) -> dict:
+    """Span attributes summarising what a node produced."""
+    attributes = {}
+    if update.get("code_solution") is not None:
+        attributes["code_chars"] = len(update["code_solution"])
+    if "execution_result" in update:
+        attributes["result_type"] = type(update["execution_result"]).__name__
+    if update.get("error_message"):
+        attributes["error_message"] = update["error_message"][:500]
+    if "final_response" in update:
+        attributes["response_type"] = update["final_response"].get("type")
+    return attributes
+
+def _node_events(name: str, update: dict) -> list:
+    """Stream events describing what a graph node just did."""
+    if name == "code_generator":
+        return [{"type": "code", "code": update.get("code_solution")}]
+    if name == "code_executor":
+        if not update.get("error_message"):
+            return [{"type": "execution", "ok": True}]
+        failed = {"type": "execution", "ok": False, "error": update["error_message"]}
+        if update.get("retries", 0) < MAX_CODE_RETRIES:
+            return [failed, {"type": "retry", "attempt": update["retries"] + 1, "error": update["error_message"]}]
+        return [failed]
+    return [{"type": "status", "text": "Preparing the answer..."}]
+
+def _observed(name: str, node):
+    """Wraps a node in a trace span and lets registered observers see its duration and output."""
+    def run_node(state: AgentState):
+        # The trace id travels in the state because nodes may run on another thread
+        with TRACER.span(f"node:{name}", trace_id=state.get('trace_id'), retries=state.get('retries', 0)) as span:
+            start = time.perf_counter()
+            update = node(state)
+            elapsed = time.perf_counter() - start
+            span.update(_describe_update(update))
+        for observer in NODE_OBSERVERS:
+            observer(name, elapsed, update)
+        return update
+    return run_node
+
+_compiled_graph = None
+_graph_lock = threading.Lock()
+GRAPH_COMPILE_SECONDS = 0.0
+
+def _build_graph():
+    # LangGraph is only needed once the first agent is built
+    from langgraph.graph import StateGraph, END
+    graph = StateGraph(AgentState)
+    
+    graph.add_node("code_generator", _observed("code_generator", code_generator_node))
+    graph.add_node("code_executor", _observed("code_executor", code_executor_node))
+    graph.add_node("figure_postprocessor", _observed("figure_postprocessor", figure_postprocessor_node))
+    graph.add_node("response_formatter", _observed("response_formatter", response_formatter_node))
+
+    graph.set_conditional_entry_point(
+        route_entry,
+        {
+            "generate": "code_generator",
+            "execute": "code_executor"
+        }
+    )
+    
+    graph.add_edge("code_generator", "code_executor")
+    graph.add_conditional_edges(
+        "code_executor",
+        should_retry,
+        {
+            "retry": "code_generator",
+            "end": "figure_postprocessor"
+        }
+    )
+    graph.add_edge("figure_postprocessor", "response_formatter")
+    graph.add_edge("response_formatter", END)
+    
+    return graph.compile()
+
+def get_compiled_graph():
+    """Returns the process-wide compiled graph, compiling it on first use."""
+    global _compiled_graph, GRAPH_COMPILE_SECONDS
+    if _compiled_graph is None:
+        with _graph_lock:
+            if _compiled_graph is None:
+                start = time.perf_counter()
+                _compiled_graph = _build_graph()
+                GRAPH_COMPILE_SECONDS = time.perf_counter() - start
+                print(f"--- Graph Compiled ({GRAPH_COMPILE_SECONDS:.3f}s) ---")
+    return _compiled_graph
+
+def dataset_fingerprint(df: pd.DataFrame) -> str:
+    """Returns a content hash of the DataFrame's values, columns and dtypes."""
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=True).values
+    except TypeError:
+        # Unhashable cells (lists, dicts) - fall back to their string form
+        row_hashes = pd.util.hash_pandas_object(df.astype(str), index=True).values
+    hasher = hashlib.sha256(row_hashes.tobytes())
+    hasher.update(repr(list(df.columns)).encode("utf-8"))
+    hasher.update(repr([str(dtype) for dtype in df.dtypes]).encode("utf-8"))
+    return hasher.hexdigest()[:16]
+
+def schema_fingerprint(df: pd.DataFrame) -> str:
+    """Returns a hash of the column names and dtypes only."""
+    schema = repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()])
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()[:16]
+
 class DataSenseAgent:
-    def __init__(self, df: pd.DataFrame):
-        self.df = df
-        aeval.symtable['df'] = self.df # Make dataframe available to the interpreter
-        self.graph = self._build_graph()
+    def __init__(self, df: pd.DataFrame, fingerprint: str = None, session_id: str = None, dataset=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.graph = get_compiled_graph()
+        self.bind_data(df, fingerprint, dataset)
 
-    def _build_graph(self):
-        graph = StateGraph(AgentState)
-        
-        graph.add_node("code_generator", code_generator_node)
-        graph.add_node("code_executor", code_executor_node)
-        graph.add_node("response_formatter", response_formatter_node)
+    def bind_data(self, df: pd.DataFrame, fingerprint: str = None, dataset=None):
+        """Points the agent at new data without rebuilding it.
 
-        graph.set_entry_point("code_generator")
-        
-        graph.add_edge("code_generator", "code_executor")
-        graph.add_conditional_edges(
-            "code_executor",
-            should_retry,
-            {
-                "retry": "code_generator",
-                "end": "response_formatter"
-            }
-        )
-        graph.add_edge("response_formatter", END)
-        
-        return graph.compile()
+        `dataset` is an out-of-core dataset (see out_of_core.py); `df` is then
+        only its sample and generated code queries the dataset through SQL.
+        """
+        self.dataset = dataset
+        self.engine = dataset.engine if dataset is not None else "pandas"
+        self.df = dataset.sample() if dataset is not None else df
+        if dataset is not None:
+            fingerprint = dataset.fingerprint
+        elif fingerprint is None and df is not None:
+            fingerprint = dataset_fingerprint(df)
+        self.fingerprint = fingerprint
+        # Code written for one engine cannot be reused on the other
+        self.schema = f"{schema_fingerprint(self.df)}:{self.engine}" if self.df is not None else None
+        # Trivial questions are answered from this; a sample's statistics would be wrong
+        self.stats_index = stats_index_for(fingerprint, df) if dataset is None and df is not None else None
+        # Built once per dataset and sent with every generation and retry instead of df.head()
+        self.data_context = None
+        if self.df is not None:
+            total_rows = dataset.row_count() if dataset is not None else None
+            self.data_context = prompt_context_for(fingerprint, self.df, self.stats_index, total_rows)
 
     # In llm_agent.py, replace the entire query method with this:
 
-    def query(self, user_prompt: str):
-        """Main function to run a query through the agent."""
+    def query(self, user_prompt: str, follow_ups: bool = True, events: queue.Queue = None):
+        """Main function to run a query through the agent.
+
+        With `follow_ups=False` no follow-up questions are generated, which
+        saves an LLM call per answer; such answers are not cached either.
+        Progress events are put on `events` if given (see `stream_query`).
+        """
         if self.df is None:
             return {"type": "string", "content": "Error: DataFrame not loaded.", "follow_up_questions": []}
 
-        df_preview = self.df.head().to_string()
-        
+        with TRACER.span("query", prompt=user_prompt[:200], session_id=self.session_id) as span:
+            response = self._query(user_prompt, span, follow_ups, events)
+            span["response_type"] = response.get("type")
+            return response
+
+    def _query(self, user_prompt: str, span: dict, follow_ups: bool = True, events: queue.Queue = None):
+        fast_response = answer_from_stats(self.stats_index, user_prompt)
+        if fast_response is not None:
+            print("--- Answered From Column Statistics ---")
+            span["source"] = "stats_index"
+            return fast_response
+
+        cached_response = QUERY_CACHE.get(self.fingerprint, user_prompt)
+        if cached_response is not None:
+            print("--- Query Cache Hit ---")
+            span["source"] = "query_cache"
+            return cached_response
+
+        if _DASHBOARD_REQUEST.search(user_prompt):
+            dashboard_response = self._start_dashboard(user_prompt)
+            if dashboard_response is not None:
+                span["source"] = "dashboard_plan"
+                return dashboard_response
+
         initial_state = {
-            "df_preview": df_preview,
+            "session_id": self.session_id,
+            "trace_id": current_trace_id(),
+            "engine": self.engine,
+            "data_context": self.data_context,
             "user_prompt": user_prompt,
             "retries": 0,
             "error_message": None
         }
+        reused_code = SEMANTIC_CACHE.lookup(self.schema, user_prompt, list(self.df.columns))
+        if reused_code:
+            initial_state["code_solution"] = reused_code
+        span["source"] = "semantic_cache" if reused_code else "graph"
         
         try:
-            # The formatter node now creates the complete, final response
-            final_state = self.graph.invoke(initial_state)
-            return final_state.get('final_response', {
-                "type": "string", 
-                "content": "An unexpected error occurred in the agent's final state."
-            })
+            # The session's sandbox only sees this agent's dataframe
+            with sandbox_session(self.session_id, self.df, self.fingerprint, self.dataset):
+                # The formatter node now creates the complete, final response
+                final_state = self._run_graph(initial_state, events)
+            if 'final_response' not in final_state:
+                return {
+                    "type": "string", 
+                    "content": "An unexpected error occurred in the agent's final state.",
+                    "error": "missing final_response"
+                }
+            response = final_state['final_response']
+            if not final_state.get('error_message'):
+                # Code that ran but produced nothing is not worth reusing
+                cacheable = final_state.get('execution_result') is not None
+                if cacheable:
+                    SEMANTIC_CACHE.add(self.schema, user_prompt, final_state['code_solution'])
+                if follow_ups:
+                    self._start_follow_ups(user_prompt, final_state, response, cache=cacheable)
+            return response
 
         except Exception as e:
             print(f"--- Critical Agent Error: {e} ---")
+            span["error"] = f"{type(e).__name__}: {e}"
             return {
                 "type": "string",
                 "content": "Sorry, a critical error occurred. The development team has been notified. Please try rephrasing your question.",
-                "follow_up_questions": []
-            }
\ No newline at end of file
+                "follow_up_questions": [],
+                "error": f"{type(e).__name__}: {e}"
+            }
+
+    def stream_query(self, user_prompt: str, follow_ups: bool = True):
+        """Runs `query` on a worker thread and yields its progress as it happens.
+
+        Events are dicts with a "type": "status" first, then "token" (chunks of
+        generated code as the LLM writes them), "code", "execution" and
+        "retry" per graph step, and finally "final" with the usual response.
+        """
+        events = queue.Queue()
+
+        def _run():
+            try:
+                response = self.query(user_prompt, follow_ups, events)
+            except Exception as e: # query handles agent errors itself; this is a last resort
+                response = {"type": "string", "content": f"Sorry, a critical error occurred: {e}",
+                            "follow_up_questions": [], "error": f"{type(e).__name__}: {e}"}
+            events.put({"type": "final", "response": response})
+
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(_run,), daemon=True)
+        worker.start()
+        yield {"type": "status", "text": "Reading your question..."}
+        while True:
+            event = events.get()
+            yield event
+            if event["type"] == "final":
+                return
+
+    def _run_graph(self, initial_state: dict, events: queue.Queue = None) -> dict:
+        """Invokes the graph, or streams it node by node when `events` is given."""
+        if events is None:
+            return self.graph.invoke(initial_state)
+        trace_id = initial_state["trace_id"]
+        with _stream_lock:
+            _stream_sinks[trace_id] = events
+        try:
+            final_state = dict(initial_state)
+            for chunk in self.graph.stream(initial_state, stream_mode="updates"):
+                for node, update in chunk.items():
+                    final_state.update(update or {})
+                    for event in _node_events(node, update or {}):
+                        events.put(event)
+            return final_state
+        finally:
+            with _stream_lock:
+                _stream_sinks.pop(trace_id, None)
+
+    def _start_dashboard(self, user_prompt: str):
+        """Plans a dashboard, then builds its charts concurrently, each with its own retries.
+
+        Returns a response whose `dashboard_job` fills in as charts finish, or
+        None when no plan could be made.
+        """
+        with TRACER.span("dashboard_plan") as plan_span:
+            specs = plan_dashboard(user_prompt, self.data_context)
+            plan_span["charts"] = len(specs)
+        if not specs:
+            return None
+        job = DashboardJob(specs)
+        for index in range(len(specs)):
+            # Each chart runs in its own copy of the context so its spans join this query's trace
+            job.futures.append(_dashboard_executor.submit(
+                contextvars.copy_context().run, self._build_chart, job, index, user_prompt
+            ))
+        print(f"--- Dashboard Planned: {len(specs)} charts ---")
+        return {"type": "dashboard", "content": [], "dashboard_job": job, "follow_up_questions": []}
+
+    def _build_chart(self, job: DashboardJob, index: int, user_prompt: str):
+        """Runs the graph for one planned chart in a sandbox of its own."""
+        spec = job.specs[index]
+        chart_session = f"{self.session_id}:chart{index}"
+        state = {
+            "session_id": chart_session,
+            "trace_id": current_trace_id(),
+            "engine": self.engine,
+            "data_context": self.data_context,
+            "user_prompt": f'{spec} This is one chart of a dashboard for: "{user_prompt}". Return a single go.Figure.',
+            "retries": 0,
+            "error_message": None
+        }
+        with TRACER.span("dashboard_chart", chart=index, spec=spec[:200]) as span:
+            try:
+                with sandbox_session(chart_session, self.df, self.fingerprint, self.dataset):
+                    final_state = self.graph.invoke(state)
+                result = final_state.get("execution_result")
+                if final_state.get("error_message"):
+                    job.errors[index] = final_state["error_message"]
+                elif isinstance(result, go.Figure):
+                    job.figures[index] = result
+                else:
+                    job.errors[index] = "The generated code did not return a chart."
+            except Exception as e:
+                job.errors[index] = f"{type(e).__name__}: {e}"
+            finally:
+                release_session(chart_session)
+            span["chart_error"] = job.errors[index]
+
+    def _start_follow_ups(self, user_prompt: str, final_state: dict, response: dict, cache: bool = True):
+        """Generates follow-ups in the background and, if `cache`, caches the answer once they arrive.
+
+        The caller gets `response` immediately; `response["follow_up_future"]`
+        resolves to the question list, which is also written back into
+        `response["follow_up_questions"]`.
+        """
+        fingerprint, code = self.fingerprint, final_state['code_solution']
+
+        def _generate():
+            with TRACER.span("follow_ups"):
+                questions = generate_follow_up_questions(user_prompt, final_state['result_summary'])
+            response["follow_up_questions"] = questions
+            if cache:
+                # Cache before the future resolves so a repeat question always hits
+                cached = {key: value for key, value in response.items() if key != "follow_up_future"}
+                QUERY_CACHE.put(fingerprint, user_prompt, code, cached)
+            return questions
+
+        # Insert the key first so the worker never sees the dict change size
+        response["follow_up_future"] = None
+        # Run in a copy of the current context so the follow-up spans join this query's trace
+        response["follow_up_future"] = _follow_up_executor.submit(contextvars.copy_context().run, _generate)
+
+# --- 5. Agent Lifecycle ---
+class AgentManager:
+    """Keeps one agent per Streamlit session and only rebinds it when the dataset changes.
+
+    The compiled graph is shared by every agent in the process, so a rerun that
+    finds the same DataFrame does no work at all; a new object with identical
+    content (e.g. a reloaded session) is recognised by its fingerprint.
+    """
+    def __init__(self):
+        self.agent = None
+        self._df_id = None
+        self.builds = 0
+        self.rebinds = 0
+        self.reuses = 0
+        self.build_seconds = 0.0
+
+    def get_agent(self, df: pd.DataFrame, fingerprint: str = None, dataset=None) -> DataSenseAgent:
+        """Returns the session's agent for `df`; pass a known `fingerprint` to skip hashing.
+
+        For an out-of-core `dataset`, `df` is ignored and the dataset's own
+        fingerprint is used.
+        """
+        source = dataset if dataset is not None else df
+        if self.agent is not None and self._df_id == id(source):
+            self.reuses += 1
+            return self.agent
+
+        start = time.perf_counter()
+        if dataset is not None:
+            fingerprint = dataset.fingerprint
+        fingerprint = fingerprint or dataset_fingerprint(df)
+        if self.agent is not None and self.agent.fingerprint == fingerprint:
+            self.agent.bind_data(df, fingerprint, dataset)
+            self.rebinds += 1
+            print(f"--- Agent Reused for Dataset {fingerprint} ---")
+        else:
+            if self.agent is not None:
+                release_session(self.agent.session_id)
+            self.agent = DataSenseAgent(df, fingerprint, dataset=dataset)
+            elapsed = time.perf_counter() - start
+            self.builds += 1
+            self.build_seconds += elapsed
+            print(f"--- Agent Built for Dataset {fingerprint} ({elapsed:.3f}s) ---")
+        self._df_id = id(source)
+        return self.agent
+
+    def stats(self) -> dict:
+        """Reports how often the agent was reused and the rerun latency this saved."""
+        avg_build = self.build_seconds / self.builds if self.builds else 0.0
+        # Before the manager every rerun recompiled the graph for a fresh agent
+        return {
+            "builds": self.builds,
+            "rebinds": self.rebinds,
+            "reuses": self.reuses,
+            "graph_compile_seconds": GRAPH_COMPILE_SECONDS,
+            "avg_build_seconds": avg_build,
+            "saved_seconds": (self.reuses + self.rebinds) * GRAPH_COMPILE_SECONDS,
+        }
@@ -0,0 +1,240 @@
+import os
+import re
+import time
+import random
+import threading
+from collections import deque
+
+from tracing import TRACER
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+# Gemini 1.5 Flash free tier allows 15 requests per minute
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("DATASENSE_LLM_RPM", "15"))
+LLM_MAX_RETRIES = int(os.getenv("DATASENSE_LLM_MAX_RETRIES", "4"))
+
+# --- Rate Limiting ---
+class TokenBucket:
+    """A thread-safe token bucket shared by every session in the process."""
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(rate_per_minute / 4, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Blocks until a token is available and returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+# --- Backends ---
+class GeminiBackend:
+    """Calls Gemini through LangChain, reusing one client per model and temperature."""
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, model: str, temperature: float):
+        key = (model, temperature)
+        with self._lock:
+            if key not in self._clients:
+                # Checked on the first real call so imports and offline runs need no key
+                from dotenv import load_dotenv
+                load_dotenv()
+                if "GOOGLE_API_KEY" not in os.environ:
+                    raise ValueError("GOOGLE_API_KEY not found in .env file. Please add it.")
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                self._clients[key] = ChatGoogleGenerativeAI(model=model, temperature=temperature)
+            return self._clients[key]
+
+    def invoke(self, prompt: str, model: str, temperature: float):
+        """Returns (text, usage) where usage holds input/output token counts if known."""
+        message = self._client(model, temperature).invoke(prompt)
+        usage = getattr(message, "usage_metadata", None) or {}
+        return message.content, {
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+        }
+
+    def stream(self, prompt: str, model: str, temperature: float, on_token):
+        """Like `invoke`, but passes each chunk of text to `on_token` as it arrives."""
+        parts, usage = [], {}
+        for chunk in self._client(model, temperature).stream(prompt):
+            if chunk.content:
+                on_token(chunk.content)
+                parts.append(chunk.content)
+            usage = getattr(chunk, "usage_metadata", None) or usage
+        return "".join(parts), {
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+        }
+
+    @staticmethod
+    def is_quota_error(error: Exception) -> bool:
+        try:
+            from google.api_core import exceptions
+            if isinstance(error, (exceptions.ResourceExhausted, exceptions.TooManyRequests)):
+                return True
+        except ImportError:
+            pass
+        message = str(error).lower()
+        return "429" in message or "quota" in message or "resource exhausted" in message
+
+class FakeLLMBackend:
+    """An offline backend returning canned responses.
+
+    `responses` is either a callable taking the prompt, a dict mapping a
+    substring of the prompt to its response (first match wins), or a list of
+    responses returned in turn. Every prompt is kept in `prompts`.
+    """
+    def __init__(self, responses, default: str = "", latency: float = 0.0):
+        self.responses = responses
+        self.default = default
+        self.latency = latency
+        self.prompts = []
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str, model: str, temperature: float):
+        with self._lock:
+            self.prompts.append(prompt)
+            if callable(self.responses):
+                text = self.responses(prompt)
+            elif isinstance(self.responses, dict):
+                text = next((reply for key, reply in self.responses.items() if key in prompt), self.default)
+            else:
+                text = self.responses[self._turn % len(self.responses)] if self.responses else self.default
+                self._turn += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return text, {"input_tokens": None, "output_tokens": None}
+
+    def stream(self, prompt: str, model: str, temperature: float, on_token):
+        """Replays the canned response word by word."""
+        text, usage = self.invoke(prompt, model, temperature)
+        for piece in re.findall(r"\S+\s*|\s+", text):
+            on_token(piece)
+        return text, usage
+
+    @staticmethod
+    def is_quota_error(error: Exception) -> bool:
+        return False
+
+# --- Client ---
+class LLMClient:
+    """The process-wide entry point for LLM calls.
+
+    Wraps a backend with a shared token-bucket rate limiter, exponential
+    backoff on quota errors and per-call latency/token metrics.
+    """
+    def __init__(self, backend=None, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 max_retries: int = LLM_MAX_RETRIES, history: int = 200):
+        self.backend = backend or GeminiBackend()
+        self.limiter = TokenBucket(requests_per_minute)
+        self.max_retries = max_retries
+        self.calls = deque(maxlen=history)
+        self.totals = {"calls": 0, "errors": 0, "retries": 0, "seconds": 0.0,
+                       "input_tokens": 0, "output_tokens": 0}
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str, temperature: float = 0, model: str = DEFAULT_MODEL, on_token=None) -> str:
+        """Sends `prompt` to the model and returns the response text.
+
+        With `on_token`, the response is streamed and each chunk is passed to
+        it as it arrives; the full text is still returned at the end. A quota
+        error after the first chunk is raised rather than retried, since a
+        retry would stream the answer again after the partial one.
+        """
+        with TRACER.span("llm", model=model, temperature=temperature, prompt_chars=len(prompt),
+                         streamed=on_token is not None) as span:
+            retries = 0
+            waited = 0.0
+            start = time.perf_counter()
+            streamed = []
+            if on_token is not None:
+                sink = on_token
+                def on_token(piece):
+                    streamed.append(True)
+                    sink(piece)
+            while True:
+                waited += self.limiter.acquire()
+                try:
+                    if on_token is not None:
+                        text, usage = self.backend.stream(prompt, model, temperature, on_token)
+                    else:
+                        text, usage = self.backend.invoke(prompt, model, temperature)
+                    break
+                except Exception as e:
+                    if retries >= self.max_retries or streamed or not self.backend.is_quota_error(e):
+                        span.update(retries=retries, rate_limit_wait_s=waited)
+                        self._record(model, prompt, "", usage={}, retries=retries,
+                                     seconds=time.perf_counter() - start, error=e)
+                        raise
+                    delay = min(2 ** retries, 60) + random.uniform(0, 1)
+                    print(f"--- LLM Quota Hit, Retrying in {delay:.1f}s ---")
+                    time.sleep(delay)
+                    retries += 1
+            call = self._record(model, prompt, text, usage, retries, time.perf_counter() - start)
+            span.update(retries=retries, rate_limit_wait_s=waited, response_chars=len(text),
+                        input_tokens=call["input_tokens"], output_tokens=call["output_tokens"])
+        return text
+
+    def _record(self, model, prompt, text, usage, retries, seconds, error=None):
+        # Gemini averages roughly four characters per token when usage is not reported
+        input_tokens = usage.get("input_tokens") or len(prompt) // 4
+        output_tokens = usage.get("output_tokens") or len(text) // 4
+        call = {
+            "model": model,
+            "seconds": seconds,
+            "retries": retries,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "error": f"{type(error).__name__}: {error}" if error else None,
+        }
+        with self._lock:
+            self.calls.append(call)
+            self.totals["calls"] += 1
+            self.totals["errors"] += 1 if error else 0
+            self.totals["retries"] += retries
+            self.totals["seconds"] += seconds
+            self.totals["input_tokens"] += input_tokens
+            self.totals["output_tokens"] += output_tokens
+        return call
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"totals": dict(self.totals), "recent": list(self.calls)}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client() -> LLMClient:
+    """Returns the shared LLM client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+def set_llm_backend(backend, requests_per_minute: float = None):
+    """Swaps the backend of the shared client, e.g. for a FakeLLMBackend offline.
+
+    Pass `requests_per_minute` to replace the rate limit as well, since a fake
+    backend has no quota to protect.
+    """
+    client = get_llm_client()
+    client.backend = backend
+    if requests_per_minute is not None:
+        client.limiter = TokenBucket(requests_per_minute)
+    return client
@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import threading
+import pandas as pd
+
+from query_cache import CACHE_DIR
+
+# CSVs larger than this are queried through DuckDB instead of loaded into pandas;
+# kept below Streamlit's default 200 MB upload limit so uploads can reach it
+OUT_OF_CORE_MB = float(os.getenv("DATASENSE_OUT_OF_CORE_MB", "150"))
+# Rows pulled into pandas for previews and the Data View tab
+OUT_OF_CORE_SAMPLE_ROWS = 10000
+# Upper bound on rows a single sql() call may return to pandas; larger results raise
+SQL_MAX_ROWS = int(os.getenv("DATASENSE_SQL_MAX_ROWS", "100000"))
+OUT_OF_CORE_DIR = os.path.join(CACHE_DIR, "out_of_core")
+
+# Read size for hashing and copying large files
+COPY_CHUNK_BYTES = 16 * 1024 * 1024
+
+def file_fingerprint(path: str) -> str:
+    """Hashes the whole file; any edited byte gives a new fingerprint and a fresh conversion."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()[:16]
+
+def copy_with_fingerprint(source, target_path: str) -> str:
+    """Streams a file object to `target_path` and returns its fingerprint, hashed on the way."""
+    hasher = hashlib.sha256()
+    with open(target_path, 'wb') as f:
+        for chunk in iter(lambda: source.read(COPY_CHUNK_BYTES), b""):
+            hasher.update(chunk)
+            f.write(chunk)
+    return hasher.hexdigest()[:16]
+
+def connect_parquet(parquet_path: str):
+    """Opens an in-process DuckDB connection with the dataset exposed as the view `data`."""
+    import duckdb
+    con = duckdb.connect()
+    escaped = parquet_path.replace("'", "''")
+    con.execute(f"CREATE VIEW data AS SELECT * FROM read_parquet('{escaped}')")
+    return con
+
+# The only table generated SQL may read
+DATA_TABLE = "data"
+
+def _walk(node):
+    """Yields every dict in a parsed query's JSON tree."""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+def check_sql(query: str):
+    """Rejects anything but a single read-only SELECT over the dataset.
+
+    The query is parsed by DuckDB (`json_serialize_sql`), which only accepts
+    SELECTs; every table it references must then be `data` or one of its own
+    CTEs, and table functions such as read_csv() are refused. A quoted file
+    name in FROM parses as a table and is refused the same way.
+    """
+    import duckdb
+    statement = query.strip().rstrip(";")
+    con = duckdb.connect()
+    try:
+        parsed = json.loads(con.execute("SELECT json_serialize_sql(?::VARCHAR)", [statement]).fetchone()[0])
+    except duckdb.Error as e:
+        raise ValueError(f"Invalid SQL: {e}")
+    finally:
+        con.close()
+    if parsed.get("error") or len(parsed.get("statements", [])) != 1:
+        detail = f" ({parsed['error_message']})" if parsed.get("error_message") else ""
+        raise ValueError(f"Only a single SELECT statement over the table `data` is allowed{detail}.")
+    nodes = list(_walk(parsed["statements"]))
+    ctes = {entry["key"] for node in nodes if isinstance(node.get("cte_map"), dict)
+            for entry in node["cte_map"].get("map", [])}
+    for node in nodes:
+        if node.get("type") == "TABLE_FUNCTION":
+            raise ValueError("The query may only read from the table `data`; table functions are not allowed.")
+        if node.get("type") == "BASE_TABLE":
+            local = node.get("catalog_name", "") == "" and node.get("schema_name", "") in ("", "main")
+            if not local or node.get("table_name") not in ctes | {DATA_TABLE}:
+                raise ValueError(f"The query may only read from the table `data`, not `{node.get('table_name')}`.")
+    return statement
+
+def run_sql(con, query: str, max_rows: int = SQL_MAX_ROWS) -> pd.DataFrame:
+    """Runs a query and returns its result as pandas.
+
+    Raises ValueError rather than truncating when the result has more than
+    `max_rows` rows, since pandas code run on a cut-off result would give
+    wrong answers without any sign of it.
+    """
+    relation = con.sql(query)
+    if relation is None: # Statements without a result set
+        return pd.DataFrame()
+    result = relation.limit(max_rows + 1).df()
+    if len(result) > max_rows:
+        raise ValueError(
+            f"The query returns more than {max_rows:,} rows. Aggregate, filter or add a LIMIT "
+            "in the SQL itself instead of fetching raw rows."
+        )
+    return result
+
+class OutOfCoreDataset:
+    """A dataset kept on disk as Parquet and queried with an embedded DuckDB engine.
+
+    Only a sample and the results of `sql()` are ever materialised in pandas.
+    """
+    engine = "duckdb"
+
+    def __init__(self, parquet_path: str, fingerprint: str):
+        self.parquet_path = parquet_path
+        self.fingerprint = fingerprint
+        self._con = connect_parquet(parquet_path)
+        self._lock = threading.Lock()
+        self._sample = None
+
+    @classmethod
+    def open_cached(cls, fingerprint: str):
+        """Reopens a previously converted dataset, or returns None if it is gone."""
+        parquet_path = os.path.join(OUT_OF_CORE_DIR, f"{fingerprint}.parquet")
+        return cls(parquet_path, fingerprint) if os.path.exists(parquet_path) else None
+
+    @classmethod
+    def from_csv(cls, csv_path: str, fingerprint: str = None):
+        """Converts a CSV to Parquet once (cached by file fingerprint) and opens it.
+
+        Pass the `fingerprint` from `copy_with_fingerprint` when the file was
+        just copied, so it is not read an extra time to hash it.
+        """
+        import duckdb
+        fingerprint = fingerprint or file_fingerprint(csv_path)
+        parquet_path = os.path.join(OUT_OF_CORE_DIR, f"{fingerprint}.parquet")
+        if not os.path.exists(parquet_path):
+            os.makedirs(OUT_OF_CORE_DIR, exist_ok=True)
+            tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+            source, target = csv_path.replace("'", "''"), tmp_path.replace("'", "''")
+            duckdb.connect().execute(
+                f"COPY (SELECT * FROM read_csv_auto('{source}')) TO '{target}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            os.replace(tmp_path, parquet_path)
+        return cls(parquet_path, fingerprint)
+
+    def sql(self, query: str) -> pd.DataFrame:
+        """Runs DuckDB SQL against the view `data`; results over SQL_MAX_ROWS rows raise ValueError."""
+        query = check_sql(query)
+        # Each call gets its own cursor so concurrent queries do not share state
+        with self._lock:
+            cursor = self._con.cursor()
+        try:
+            return run_sql(cursor, query)
+        finally:
+            cursor.close()
+
+    def row_count(self) -> int:
+        return int(self.sql("SELECT COUNT(*) AS n FROM data")["n"].iloc[0])
+
+    def sample(self, rows: int = OUT_OF_CORE_SAMPLE_ROWS) -> pd.DataFrame:
+        """A reproducible random sample used for previews, cached after the first call."""
+        if self._sample is None:
+            self._sample = self.sql(f"SELECT * FROM data USING SAMPLE reservoir({rows} ROWS) REPEATABLE (42)")
+        return self._sample
@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from column_stats import build_stats_index
+
+# Rough size of the dataset description sent to the LLM (about 4 characters per token)
+PROMPT_CONTEXT_MAX_CHARS = int(os.getenv("DATASENSE_PROMPT_CONTEXT_CHARS", "4000"))
+# Example values shown per column
+CONTEXT_EXAMPLES = 3
+# Example values longer than this are cut short
+CONTEXT_VALUE_CHARS = 30
+CONTEXT_CACHE_MAX_ENTRIES = 16
+
+_contexts = OrderedDict()
+_contexts_lock = threading.Lock()
+
+def _short(value) -> str:
+    text = str(value)
+    return repr(text[:CONTEXT_VALUE_CHARS] + "…") if len(text) > CONTEXT_VALUE_CHARS else repr(text)
+
+def _number(value) -> str:
+    return f"{value:.4g}" if isinstance(value, (float, np.floating)) else str(value)
+
+def _column_line(column, stats: dict, rows: int) -> str:
+    """One line per column: dtype, null rate, then a range for numbers/dates or examples otherwise."""
+    parts = [f"- {column} ({stats['dtype']})"]
+    if stats["nulls"]:
+        parts.append(f"{stats['nulls'] / max(rows, 1):.1%} null")
+    if stats.get("mean") is not None and not pd.isna(stats.get("mean")):
+        parts.append(f"range {_number(stats['min'])} to {_number(stats['max'])}, mean {_number(stats['mean'])}")
+    elif stats.get("min") is not None and not pd.isna(stats.get("min")):
+        parts.append(f"range {stats['min']} to {stats['max']}")
+    else:
+        if stats["distinct"] is not None:
+            parts.append(f"{stats['distinct']:,} distinct")
+        examples = [_short(value) for value, _ in stats["top"][:CONTEXT_EXAMPLES]]
+        if examples:
+            parts.append("e.g. " + ", ".join(examples))
+    return ": ".join([parts[0], "; ".join(parts[1:])]) if len(parts) > 1 else parts[0]
+
+def build_prompt_context(df: pd.DataFrame, stats_index: dict = None, total_rows: int = None,
+                         max_chars: int = PROMPT_CONTEXT_MAX_CHARS) -> str:
+    """Describes a dataset for the LLM within a character budget.
+
+    Columns are described in order until most of the budget is used; the rest
+    are listed by name and dtype only, and any still left over are counted.
+    """
+    stats_index = stats_index or build_stats_index(df)
+    rows = total_rows if total_rows is not None else stats_index["rows"]
+    lines = [f"{rows:,} rows x {len(stats_index['columns'])} columns."]
+    if rows != stats_index["rows"]:
+        lines[0] += f" Column statistics are estimated from a {stats_index['rows']:,}-row sample."
+    used = len(lines[0])
+    remaining = list(stats_index["columns"])
+    while remaining:
+        line = _column_line(remaining[0], stats_index["stats"][remaining[0]], stats_index["rows"])
+        if used + len(line) > 0.8 * max_chars:
+            break
+        lines.append(line)
+        used += len(line) + 1
+        remaining.pop(0)
+
+    if remaining:
+        names = []
+        for column in remaining:
+            name = f"{column} ({stats_index['stats'][column]['dtype']})"
+            if used + len(name) + 2 > max_chars:
+                break
+            names.append(name)
+            used += len(name) + 2
+        if names:
+            lines.append("Other columns: " + ", ".join(names))
+        if len(names) < len(remaining):
+            lines.append(f"... and {len(remaining) - len(names)} more columns.")
+    return "\n".join(lines)
+
+def prompt_context_for(fingerprint: str, df: pd.DataFrame, stats_index: dict = None,
+                       total_rows: int = None) -> str:
+    """Returns the dataset's prompt context, building it once per fingerprint."""
+    with _contexts_lock:
+        if fingerprint in _contexts:
+            _contexts.move_to_end(fingerprint)
+            return _contexts[fingerprint]
+    context = build_prompt_context(df, stats_index, total_rows)
+    with _contexts_lock:
+        _contexts[fingerprint] = context
+        if len(_contexts) > CONTEXT_CACHE_MAX_ENTRIES:
+            _contexts.popitem(last=False)
+    return context
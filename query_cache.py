@@ -0,0 +1,278 @@
+import os
+import re
+import time
+import pickle
+import sqlite3
+import hashlib
+import math
+import threading
+from collections import Counter
+
+CACHE_DIR = os.getenv("DATASENSE_CACHE_DIR", ".datasense_cache")
+CACHE_MAX_ENTRIES = int(os.getenv("DATASENSE_CACHE_MAX_ENTRIES", "500"))
+SEMANTIC_THRESHOLD = float(os.getenv("DATASENSE_SEMANTIC_THRESHOLD", "0.75"))
+SEMANTIC_MAX_ENTRIES = int(os.getenv("DATASENSE_SEMANTIC_MAX_ENTRIES", "200"))
+# "lru" evicts the least recently reused prompt, "fifo" the oldest one
+SEMANTIC_EVICTION = os.getenv("DATASENSE_SEMANTIC_EVICTION", "lru")
+
+# A quoted value, or a single word
+_TOKEN = re.compile(r"""(?<!\w)(["'`]).+?\1(?!\w)|\w+""")
+
+def _fold_case(match: re.Match) -> str:
+    token = match.group(0)
+    # Quoted text and capitalized words after the first are usually values ('North', Alice)
+    if match.group(1) or (match.start() > 0 and token[:1].isupper()):
+        return token
+    return token.lower()
+
+def normalize_prompt(prompt: str) -> str:
+    """Strips whitespace and trailing punctuation differences and lowercases the prompt.
+
+    Quoted text and capitalized words keep their case, since a filter on
+    "Alice" is not a filter on "alice".
+    """
+    prompt = re.sub(r'\s+', ' ', prompt.strip()).rstrip(' ?.!')
+    return _TOKEN.sub(_fold_case, prompt)
+
+class QueryCache:
+    """A persistent, size-bounded LRU cache of answered questions.
+
+    Entries are keyed on the dataset fingerprint (data and dtypes) plus the
+    normalized prompt and hold the generated code and the pickled final
+    response, follow-up questions included. The cache lives in a local file
+    written only by this app, which is what makes unpickling it acceptable.
+    """
+    def __init__(self, path: str = None, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path or os.path.join(CACHE_DIR, "query_cache.sqlite")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    key TEXT PRIMARY KEY,
+                    code TEXT,
+                    response BLOB,
+                    last_access REAL
+                )
+            """)
+        return self._conn
+
+    @staticmethod
+    def make_key(fingerprint: str, prompt: str) -> str:
+        return hashlib.sha256(f"{fingerprint}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def get(self, fingerprint: str, prompt: str):
+        """Returns the cached final response, or None on a miss."""
+        key = self.make_key(fingerprint, prompt)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response FROM query_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE query_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, fingerprint: str, prompt: str, code: str, response: dict):
+        """Stores a successful answer and evicts the least recently used overflow."""
+        key = self.make_key(fingerprint, prompt)
+        try:
+            blob = pickle.dumps(response)
+        except Exception as e:
+            print(f"--- Query Cache Skipped: {e} ---")
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, code, response, last_access) VALUES (?, ?, ?, ?)",
+                    (key, code, blob, time.time())
+                )
+                conn.execute("""
+                    DELETE FROM query_cache WHERE key IN (
+                        SELECT key FROM query_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "max_entries": self.max_entries}
+
+QUERY_CACHE = QueryCache()
+
+# --- Semantic Cache ---
+# Words that mean the same thing to the code generator
+SYNONYMS = {
+    "average": "mean", "avg": "mean", "per": "by", "each": "by", "total": "sum",
+    "maximum": "max", "highest": "max", "largest": "max", "minimum": "min",
+    "lowest": "min", "smallest": "min", "chart": "plot", "graph": "plot",
+    "show": "plot", "display": "plot", "distinct": "unique",
+}
+# Words that can differ between two prompts without changing the answer
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "what", "whats", "s", "please", "can",
+    "could", "would", "you", "i", "me", "we", "my", "our", "tell", "give", "find", "get",
+    "calculate", "compute", "there", "this", "that", "it", "its", "of", "in", "on", "for",
+    "to", "from", "with", "at", "do", "does", "dataset", "data", "table", "df", "dataframe",
+    "value", "values", "how",
+}
+
+def _canonical_words(prompt: str) -> list:
+    """The prompt's words with synonyms unified; a quoted value stays one token."""
+    return [SYNONYMS.get(token, token) for token in
+            (match.group(0) for match in _TOKEN.finditer(normalize_prompt(prompt)))]
+
+def _ngrams(words: list, n: int = 3) -> Counter:
+    grams = Counter()
+    for word in words:
+        padded = f" {word} "
+        grams.update(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+    return grams
+
+def _signature_words(words: list, columns: list) -> list:
+    """The prompt's words that carry meaning, in order: every word but stopwords.
+
+    That is aggregations, chart types and column names, and also numbers,
+    negations and values such as North or 'Alice'. A column that happens to
+    be named like a stopword still counts.
+    """
+    lowered = {str(column).lower() for column in columns}
+    return [word for word in words if word not in STOPWORDS or word in lowered]
+
+def _signature(words: list, columns: list) -> frozenset:
+    """The parts of a prompt that must be identical before code is reused."""
+    return frozenset(_signature_words(words, columns))
+
+class SemanticCache:
+    """Reuses generated code across paraphrased questions on the same schema.
+
+    A match requires the same words apart from stopwords and synonyms, which
+    keeps "max sales" from reusing the code for "mean sales" and "the North
+    region" from reusing the code for "the South region". Candidates are then
+    scored with TF-IDF weighted character trigrams of those words only, so
+    filler ("what is the ... for each") never lowers the score and the index
+    runs entirely offline.
+    """
+    def __init__(self, path: str = None, threshold: float = SEMANTIC_THRESHOLD,
+                 max_entries: int = SEMANTIC_MAX_ENTRIES, eviction: str = SEMANTIC_EVICTION):
+        self.path = path or os.path.join(CACHE_DIR, "query_cache.sqlite")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.eviction = eviction
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._indexes = {}
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS semantic_cache (
+                    schema TEXT,
+                    prompt TEXT,
+                    code TEXT,
+                    created REAL,
+                    last_used REAL,
+                    PRIMARY KEY (schema, prompt)
+                )
+            """)
+        return self._conn
+
+    def _index(self, schema: str) -> dict:
+        """Loads a schema's past prompts as {normalized prompt: (words, code)}."""
+        if schema not in self._indexes:
+            rows = self._connect().execute(
+                "SELECT prompt, code FROM semantic_cache WHERE schema = ?", (schema,)
+            ).fetchall()
+            self._indexes[schema] = {prompt: (_canonical_words(prompt), code) for prompt, code in rows}
+        return self._indexes[schema]
+
+    @staticmethod
+    def _cosine(a: Counter, b: Counter, idf: dict) -> float:
+        dot = sum(count * b[gram] * idf[gram] ** 2 for gram, count in a.items() if gram in b)
+        norm_a = math.sqrt(sum((count * idf[gram]) ** 2 for gram, count in a.items()))
+        norm_b = math.sqrt(sum((count * idf[gram]) ** 2 for gram, count in b.items()))
+        return dot / (norm_a * norm_b) if norm_a and norm_b else 0.0
+
+    def lookup(self, schema: str, prompt: str, columns: list):
+        """Returns code that answered a close enough past prompt, or None."""
+        meaningful = _signature_words(_canonical_words(prompt), columns)
+        grams = _ngrams(meaningful)
+        signature = frozenset(meaningful)
+        with self._lock:
+            index = self._index(schema)
+            if not index:
+                self.misses += 1
+                return None
+            entry_grams = {entry_prompt: _ngrams(_signature_words(entry_words, columns))
+                           for entry_prompt, (entry_words, _) in index.items()}
+            # IDF over the schema's prompts plus the new one
+            doc_freq = Counter(grams.keys())
+            for entry in entry_grams.values():
+                doc_freq.update(entry.keys())
+            total = len(index) + 1
+            idf = {gram: math.log((1 + total) / (1 + freq)) + 1 for gram, freq in doc_freq.items()}
+
+            best_prompt, best_score = None, 0.0
+            for entry_prompt, (entry_words, _) in index.items():
+                if _signature(entry_words, columns) != signature:
+                    continue
+                score = self._cosine(grams, entry_grams[entry_prompt], idf)
+                if score > best_score:
+                    best_prompt, best_score = entry_prompt, score
+            if best_prompt is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "UPDATE semantic_cache SET last_used = ? WHERE schema = ? AND prompt = ?",
+                    (time.time(), schema, best_prompt)
+                )
+            print(f"--- Semantic Cache Hit ({best_score:.2f}): '{best_prompt}' ---")
+            return index[best_prompt][1]
+
+    def add(self, schema: str, prompt: str, code: str):
+        """Records code that ran successfully for a prompt."""
+        normalized = normalize_prompt(prompt)
+        now = time.time()
+        order_column = "last_used" if self.eviction == "lru" else "created"
+        with self._lock:
+            index = self._index(schema)
+            conn = self._connect()
+            with conn:
+                conn.execute("""
+                    INSERT INTO semantic_cache (schema, prompt, code, created, last_used) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (schema, prompt) DO UPDATE SET code = excluded.code, last_used = excluded.last_used
+                """, (schema, normalized, code, now, now))
+                evicted = conn.execute(f"""
+                    SELECT prompt FROM semantic_cache WHERE schema = ?
+                    ORDER BY {order_column} DESC LIMIT -1 OFFSET ?
+                """, (schema, self.max_entries)).fetchall()
+                conn.executemany(
+                    "DELETE FROM semantic_cache WHERE schema = ? AND prompt = ?",
+                    [(schema, row[0]) for row in evicted]
+                )
+            index[normalized] = (_canonical_words(prompt), code)
+            for row in evicted:
+                index.pop(row[0], None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "threshold": self.threshold,
+                "max_entries": self.max_entries, "eviction": self.eviction}
+
+SEMANTIC_CACHE = SemanticCache()
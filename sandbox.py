@@ -0,0 +1,417 @@
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+import pandas as pd
+import plotly.graph_objects as go
+from asteval import Interpreter
+
+# --- Execution Settings ---
+# "inline" runs generated code in the Streamlit process; "process" uses worker processes
+EXECUTION_BACKEND = os.getenv("DATASENSE_EXECUTOR", "inline")
+EXEC_TIMEOUT_SECONDS = float(os.getenv("DATASENSE_EXEC_TIMEOUT", "30"))
+EXEC_MAX_RSS_MB = int(os.getenv("DATASENSE_EXEC_MAX_RSS_MB", "2048"))
+EXEC_WORKERS = int(os.getenv("DATASENSE_EXEC_WORKERS", "2"))
+# Interpreters kept by the inline backend, one per active session
+INTERPRETER_POOL_SIZE = int(os.getenv("DATASENSE_INTERPRETER_POOL_SIZE", "8"))
+SHARED_DATA_DIR = os.path.join(tempfile.gettempdir(), "datasense_shared")
+
+class SandboxLimitError(Exception):
+    """Raised when generated code exceeds its time or memory budget."""
+
+class CodeExecutionError(Exception):
+    """Raised when generated code fails inside the interpreter."""
+
+# --- Interpreter Pool ---
+
+def _new_interpreter():
+    """Creates an interpreter with the modules generated code is allowed to use."""
+    interpreter = Interpreter()
+    interpreter.symtable['pd'] = pd
+    interpreter.symtable['go'] = go
+    return interpreter
+
+class _PooledInterpreter:
+    def __init__(self):
+        self.interpreter = _new_interpreter()
+        # Every name and value present after warm-up is the clean baseline
+        self.baseline = dict(self.interpreter.symtable)
+        self.lock = threading.Lock()
+        self.leases = 0
+
+    def reset(self):
+        """Drops names added since warm-up and restores any baseline name that was rebound or deleted.
+
+        Interpreters move between sessions, so `len = 7` in one session must
+        not leak into the next.
+        """
+        symtable = self.interpreter.symtable
+        for name in list(symtable.keys()):
+            if name not in self.baseline:
+                del symtable[name]
+        for name, value in self.baseline.items():
+            if symtable.get(name) is not value:
+                symtable[name] = value
+        self.interpreter.error = []
+
+def _evaluate(interpreter: Interpreter, code: str):
+    """Evaluates `code`, raising the errors asteval records instead of returning None."""
+    interpreter.error = []
+    result = interpreter.eval(code, show_errors=False)
+    if interpreter.error:
+        message = "; ".join(f"{name}: {detail.strip()}" for name, detail in (e.get_error() for e in interpreter.error))
+        interpreter.error = []
+        raise CodeExecutionError(message)
+    return result
+
+class InterpreterPool:
+    """A bounded pool of pre-warmed asteval interpreters, one per session.
+
+    Each session leases its own interpreter so concurrent users never see each
+    other's data. Idle interpreters beyond `max_size` are evicted least recently
+    used first and recycled for new sessions.
+    """
+    def __init__(self, max_size: int = INTERPRETER_POOL_SIZE, prewarm: int = 2):
+        self.max_size = max_size
+        self.prewarm = prewarm
+        self._free = []
+        self._by_session = OrderedDict()
+        self._cond = threading.Condition()
+        self._warmed = False
+
+    def _warm(self):
+        if not self._warmed:
+            self._free.extend(_PooledInterpreter() for _ in range(self.prewarm))
+            self._warmed = True
+
+    def _acquire(self, session_id: str) -> _PooledInterpreter:
+        with self._cond:
+            self._warm()
+            while True:
+                pooled = self._by_session.get(session_id)
+                if pooled is not None:
+                    self._by_session.move_to_end(session_id)
+                    break
+                if self._free:
+                    pooled = self._free.pop()
+                elif len(self._by_session) < self.max_size:
+                    pooled = _PooledInterpreter()
+                else:
+                    pooled = self._evict_idle()
+                if pooled is not None:
+                    self._by_session[session_id] = pooled
+                    break
+                # Every interpreter is mid-query; wait for one to be returned
+                self._cond.wait()
+            pooled.leases += 1
+            return pooled
+
+    def _evict_idle(self):
+        for session_id, pooled in self._by_session.items():
+            if pooled.leases == 0:
+                del self._by_session[session_id]
+                pooled.reset()
+                print(f"--- Sandbox Evicted for Session {session_id} ---")
+                return pooled
+        return None
+
+    def _return(self, pooled: _PooledInterpreter):
+        with self._cond:
+            pooled.leases -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, session_id: str, bindings: dict):
+        """Checks out the session's interpreter with `bindings` (e.g. df) in scope."""
+        pooled = self._acquire(session_id)
+        try:
+            with pooled.lock:
+                pooled.reset()
+                pooled.interpreter.symtable.update(bindings)
+                try:
+                    yield pooled.interpreter
+                finally:
+                    # Variables left behind by generated code do not outlive the query
+                    pooled.reset()
+        finally:
+            self._return(pooled)
+
+    def interpreter_for(self, session_id: str) -> Interpreter:
+        """Returns the interpreter currently leased to a session."""
+        with self._cond:
+            pooled = self._by_session.get(session_id)
+        if pooled is None or pooled.leases == 0:
+            raise RuntimeError(f"No sandbox is leased to session {session_id}.")
+        return pooled.interpreter
+
+    def release(self, session_id: str):
+        """Returns a session's interpreter to the free list."""
+        with self._cond:
+            pooled = self._by_session.get(session_id)
+            if pooled is not None and pooled.leases == 0:
+                del self._by_session[session_id]
+                pooled.reset()
+                self._free.append(pooled)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "sessions": len(self._by_session),
+                "free": len(self._free),
+                "max_size": self.max_size,
+            }
+
+INTERPRETER_POOL = InterpreterPool()
+
+
+# --- Process Sandbox ---
+
+def _load_shared_frame(path: str, frames: dict) -> pd.DataFrame:
+    """Reads a shared DataFrame into the worker, once per worker.
+
+    The Arrow file is memory-mapped but still converted to a full, writable
+    pandas copy (zero-copy columns would be read-only and break in-place edits),
+    so each worker holds its own copy of the dataset. Pickle files are the
+    fallback for frames Arrow cannot represent.
+    """
+    if path not in frames:
+        frames.clear() # A worker only ever needs the most recent dataset
+        if path.endswith(".pkl"):
+            frames[path] = pd.read_pickle(path)
+        else:
+            import pyarrow as pa
+            with pa.memory_map(path, 'r') as source:
+                frames[path] = pa.ipc.open_file(source).read_all().to_pandas()
+    return frames[path]
+
+def _load_shared_bindings(path: str, frames: dict) -> dict:
+    """Symbols for a shared dataset: `df` for Arrow files, `sql`/`df_sample` for Parquet."""
+    if not path.endswith(".parquet"):
+        return {'df': _load_shared_frame(path, frames)}
+    if path not in frames:
+        from out_of_core import OutOfCoreDataset
+        frames.clear()
+        frames[path] = OutOfCoreDataset(path, os.path.basename(path))
+    dataset = frames[path]
+    return {'sql': dataset.sql, 'df_sample': dataset.sample()}
+
+def _worker_main(conn):
+    """Worker loop: evaluates (dataset path, code) requests until told to stop."""
+    pooled = _PooledInterpreter()
+    frames = {}
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        path, code = request
+        try:
+            pooled.reset()
+            pooled.interpreter.symtable.update(_load_shared_bindings(path, frames))
+            # Loading is done; the time and memory limits apply from here
+            conn.send(("ready", None))
+            reply = ("ok", _evaluate(pooled.interpreter, code))
+        except BaseException as e:
+            reply = ("error", f"{type(e).__name__} - {e}")
+        try:
+            conn.send(reply)
+        except Exception as e:
+            conn.send(("error", f"Result could not be returned: {type(e).__name__} - {e}"))
+
+def _rss_mb(pid: int):
+    """Resident set size of a process in MB, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+
+    def stop(self, force: bool = False):
+        if force:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(timeout=1)
+
+class ProcessSandbox:
+    """Runs generated code in worker processes with a wall-clock and RSS budget.
+
+    The DataFrame is written once per dataset to an Arrow IPC file (a pickle if
+    Arrow cannot hold it) that each worker loads once, so a query only sends the
+    file path and the code. Every worker keeps its own copy of the dataset; the
+    time limit starts after that load and the memory limit counts only what the
+    code uses on top of it. A worker that overruns its budget is killed and
+    replaced.
+    """
+    def __init__(self, max_workers: int = EXEC_WORKERS, timeout: float = EXEC_TIMEOUT_SECONDS,
+                 max_rss_mb: int = EXEC_MAX_RSS_MB, keep_datasets: int = 8):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self.keep_datasets = keep_datasets
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._share_errors = {}
+
+    def share(self, session_id: str, df: pd.DataFrame, fingerprint: str):
+        """Makes `df` available to workers for the session's next runs.
+
+        A frame that cannot be written is not raised here; the session's runs
+        fail with the reason instead, so it is reported like any execution error.
+        """
+        with self._lock:
+            self._share_errors.pop(session_id, None)
+            try:
+                self._paths[session_id] = self._write_shared(df, fingerprint)
+            except Exception as e:
+                print(f"--- Could not share dataset with workers: {type(e).__name__} - {e} ---")
+                self._paths.pop(session_id, None)
+                self._share_errors[session_id] = f"{type(e).__name__} - {e}"
+
+    def _write_shared(self, df: pd.DataFrame, fingerprint: str) -> str:
+        import pyarrow as pa
+        for path in (os.path.join(SHARED_DATA_DIR, f"{fingerprint}.{ext}") for ext in ("arrow", "pkl")):
+            if os.path.exists(path):
+                return path
+        os.makedirs(SHARED_DATA_DIR, exist_ok=True)
+        try:
+            table = pa.Table.from_pandas(df)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            # e.g. object columns mixing numbers and strings; pickle keeps them as they are
+            print(f"--- Arrow cannot hold this dataset ({e}), sharing it as a pickle ---")
+            table = None
+        path = os.path.join(SHARED_DATA_DIR, f"{fingerprint}.{'arrow' if table is not None else 'pkl'}")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if table is not None:
+                with pa.OSFile(tmp_path, 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._prune()
+        return path
+
+    def share_dataset(self, session_id: str, dataset):
+        """Points the session at an out-of-core dataset, which workers query in place."""
+        with self._lock:
+            self._share_errors.pop(session_id, None)
+            self._paths[session_id] = dataset.parquet_path
+
+    def release(self, session_id: str):
+        """Forgets a session's dataset; the shared file stays for other sessions."""
+        with self._lock:
+            self._paths.pop(session_id, None)
+            self._share_errors.pop(session_id, None)
+
+    def _prune(self):
+        files = sorted(
+            (os.path.join(SHARED_DATA_DIR, f) for f in os.listdir(SHARED_DATA_DIR) if f.endswith((".arrow", ".pkl"))),
+            key=os.path.getmtime,
+            reverse=True
+        )
+        in_use = set(self._paths.values())
+        for stale in files[self.keep_datasets:]:
+            if stale not in in_use:
+                os.remove(stale)
+
+    def run(self, session_id: str, code: str):
+        """Evaluates `code` against the session's shared DataFrame in a worker."""
+        path = self._paths.get(session_id)
+        if path is None:
+            if session_id in self._share_errors:
+                raise RuntimeError(f"The dataset could not be passed to the sandbox: {self._share_errors[session_id]}")
+            raise RuntimeError(f"No dataset is shared for session {session_id}.")
+        with self._slots:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else _Worker(self._context)
+            try:
+                status, payload = self._wait(worker, path, code)
+            except BaseException:
+                worker.stop(force=True)
+                raise
+            with self._lock:
+                self._idle.append(worker)
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def _wait(self, worker: _Worker, path: str, code: str):
+        worker.conn.send((path, code))
+        # Loading the dataset is not charged to the code: wait for it unbounded
+        while not worker.conn.poll(0.05):
+            if not worker.process.is_alive():
+                raise SandboxLimitError("worker process exited while loading the dataset (likely out of memory)")
+        status, payload = worker.conn.recv()
+        if status != "ready":
+            return status, payload
+        loaded_rss = _rss_mb(worker.process.pid) or 0
+        start = time.monotonic()
+        while not worker.conn.poll(0.05):
+            if not worker.process.is_alive():
+                raise SandboxLimitError("worker process exited unexpectedly (likely out of memory)")
+            if time.monotonic() - start > self.timeout:
+                raise SandboxLimitError(f"code ran longer than the {self.timeout:.0f}s time limit")
+            rss = _rss_mb(worker.process.pid)
+            if rss is not None and rss - loaded_rss > self.max_rss_mb:
+                raise SandboxLimitError(f"code used {rss - loaded_rss:.0f} MB, over the {self.max_rss_mb} MB memory limit")
+        return worker.conn.recv()
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._idle:
+                worker.stop()
+            self._idle = []
+
+PROCESS_SANDBOX = ProcessSandbox()
+
+# --- Backend Dispatch ---
+
+@contextmanager
+def sandbox_session(session_id: str, df: pd.DataFrame, fingerprint: str, dataset=None):
+    """Prepares the configured backend so `execute_code` can run against `df`.
+
+    With an out-of-core `dataset`, code gets `sql()` and `df_sample` instead of `df`.
+    """
+    if EXECUTION_BACKEND == "process":
+        if dataset is not None:
+            PROCESS_SANDBOX.share_dataset(session_id, dataset)
+        else:
+            PROCESS_SANDBOX.share(session_id, df, fingerprint)
+        yield
+    else:
+        bindings = {'sql': dataset.sql, 'df_sample': dataset.sample()} if dataset is not None else {'df': df}
+        with INTERPRETER_POOL.lease(session_id, bindings):
+            yield
+
+def execute_code(session_id: str, code: str):
+    """Runs generated code for a session on the configured backend."""
+    if EXECUTION_BACKEND == "process":
+        return PROCESS_SANDBOX.run(session_id, code)
+    return _evaluate(INTERPRETER_POOL.interpreter_for(session_id), code)
+
+def release_session(session_id: str):
+    """Frees whatever the configured backend holds for a finished session."""
+    if EXECUTION_BACKEND == "process":
+        PROCESS_SANDBOX.release(session_id)
+    else:
+        INTERPRETER_POOL.release(session_id)
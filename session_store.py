@@ -0,0 +1,430 @@
+import os
+import io
+import json
+import time
+import zlib
+import base64
+import pickle
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+from plotly import io as pio
+import plotly.graph_objects as go
+
+CHAT_HISTORY_DIR = "chat_history"
+SESSION_DB_PATH = os.path.join(CHAT_HISTORY_DIR, "sessions.sqlite")
+# Datasets are shared by every session that analyses the same data
+DATASET_DIR = os.path.join(CHAT_HISTORY_DIR, "datasets")
+# Parquet metadata key recording how to restore labels and values of a stored dataset
+DATASET_META_KEY = b"datasense_restore"
+# Only this many rows of a tabular result are written to a saved session
+SESSION_TABLE_MAX_ROWS = 10000
+
+# Decoded figures and tables kept in memory, keyed by blob hash
+DECODED_CACHE_MAX_ENTRIES = 64
+
+_migrated = False
+_migration_lock = threading.Lock()
+_schema_ready = False
+_schema_lock = threading.Lock()
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+
+# --- Encoding ---
+
+def dataframe_to_parquet_bytes(df: pd.DataFrame, max_rows: int = SESSION_TABLE_MAX_ROWS) -> bytes:
+    """Encodes a table result as zstd Parquet, keeping at most `max_rows` rows."""
+    table = df.head(max_rows).copy()
+    # Parquet needs plain string column names
+    table.columns = [
+        " / ".join(map(str, column)) if isinstance(column, tuple) else str(column)
+        for column in table.columns
+    ]
+    buffer = io.BytesIO()
+    try:
+        table.to_parquet(buffer, engine="pyarrow", compression="zstd")
+    except Exception:
+        # Mixed-type object columns cannot be stored as Parquet; keep their text instead
+        buffer = io.BytesIO()
+        table.astype(str).to_parquet(buffer, engine="pyarrow", compression="zstd")
+    return buffer.getvalue()
+
+def parquet_bytes_to_dataframe(data: bytes) -> pd.DataFrame:
+    return pd.read_parquet(io.BytesIO(data), engine="pyarrow")
+
+# --- Datasets ---
+
+def _dataset_path(dataset_hash: str) -> str:
+    return os.path.join(DATASET_DIR, f"{dataset_hash}.parquet")
+
+def store_dataset(df: pd.DataFrame, dataset_hash: str) -> str:
+    """Writes `df` to a content-addressed Parquet file unless it is already stored.
+
+    The file must load back as the same data its hash names: column labels
+    Parquet cannot hold (non-strings, duplicates) are kept in the file's
+    metadata, and cells of columns Arrow cannot type (e.g. mixed numbers and
+    strings) are pickled one by one instead of being turned into text.
+    """
+    path = _dataset_path(dataset_hash)
+    if os.path.exists(path):
+        return path
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    table, restore = df, {}
+    if not all(isinstance(column, str) for column in df.columns) or not df.columns.is_unique:
+        table = df.set_axis([str(i) for i in range(df.shape[1])], axis=1)
+        restore["columns"] = base64.b64encode(pickle.dumps(df.columns)).decode("ascii")
+    try:
+        arrow_table = pa.Table.from_pandas(table)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        pickled = []
+        for position, column in enumerate(table.columns):
+            try:
+                pa.array(table.iloc[:, position], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                pickled.append(column)
+        table = table.assign(**{column: table[column].map(pickle.dumps) for column in pickled})
+        restore["pickled"] = pickled
+        arrow_table = pa.Table.from_pandas(table)
+    if restore:
+        metadata = dict(arrow_table.schema.metadata or {})
+        metadata[DATASET_META_KEY] = json.dumps(restore).encode("utf-8")
+        arrow_table = arrow_table.replace_schema_metadata(metadata)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(arrow_table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+    return path
+
+def load_dataset(dataset_hash: str) -> pd.DataFrame:
+    """Memory-maps a stored dataset with its original dtypes, labels and values."""
+    import pyarrow.parquet as pq
+    path = _dataset_path(dataset_hash)
+    df = pd.read_parquet(path, engine="pyarrow", memory_map=True)
+    restore = (pq.read_schema(path).metadata or {}).get(DATASET_META_KEY)
+    if restore:
+        restore = json.loads(restore)
+        for column in restore.get("pickled", []):
+            df[column] = df[column].map(pickle.loads)
+        if "columns" in restore:
+            df.columns = pickle.loads(base64.b64decode(restore["columns"]))
+    return df
+
+# --- Storage ---
+
+def _connect():
+    global _schema_ready
+    os.makedirs(os.path.dirname(SESSION_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(SESSION_DB_PATH, timeout=30)
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                _create_schema(conn)
+                _schema_ready = True
+    return conn
+
+def _create_schema(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            created_at REAL,
+            updated_at REAL,
+            dataset_hash TEXT
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            session_id TEXT,
+            seq INTEGER,
+            role TEXT,
+            content TEXT,
+            PRIMARY KEY (session_id, seq)
+        );
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            kind TEXT,
+            data BLOB
+        );
+    """)
+    # The sidebar index columns were added after the first SQLite release
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    with conn:
+        if "title" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN title TEXT")
+            conn.execute("""
+                UPDATE sessions SET title = (
+                    SELECT substr(json_extract(content, '$.text'), 1, 80) FROM messages
+                    WHERE messages.session_id = sessions.id AND role = 'user' ORDER BY seq LIMIT 1
+                )
+            """)
+        if "message_count" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN message_count INTEGER")
+            conn.execute("""
+                UPDATE sessions SET message_count = (
+                    SELECT COUNT(*) FROM messages WHERE messages.session_id = sessions.id
+                )
+            """)
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_by_update ON sessions (updated_at DESC)")
+
+def _put_blob(conn, kind: str, data: bytes) -> str:
+    """Stores `data` once under its content hash and returns the hash."""
+    digest = hashlib.sha256(data).hexdigest()
+    conn.execute(
+        "INSERT OR IGNORE INTO blobs (hash, kind, data) VALUES (?, ?, ?)",
+        (digest, kind, zlib.compress(data))
+    )
+    return digest
+
+def _get_blob(conn, digest: str) -> bytes:
+    row = conn.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+    return zlib.decompress(row[0]) if row else None
+
+def _encode_content(conn, content):
+    """Turns message content into JSON, moving figures and tables into blobs."""
+    if isinstance(content, dict) and content.get("blob") and content.get("data") is None:
+        # A lazily loaded message that was never displayed is still a reference
+        return {key: value for key, value in content.items() if key != "data"}
+    if isinstance(content, dict) and content.get("type") == "plot" and isinstance(content.get("data"), go.Figure):
+        return {"type": "plot", "blob": _put_blob(conn, "figure", pio.to_json(content["data"]).encode("utf-8"))}
+    if isinstance(content, dict) and content.get("type") == "dataframe" and isinstance(content.get("data"), pd.DataFrame):
+        return {
+            "type": "dataframe",
+            "blob": _put_blob(conn, "table", dataframe_to_parquet_bytes(content["data"])),
+            "total_rows": content.get("total_rows")
+        }
+    if isinstance(content, list) and content and all(isinstance(item, go.Figure) for item in content):
+        return {"type": "dashboard", "blobs": [
+            _put_blob(conn, "figure", pio.to_json(fig).encode("utf-8")) for fig in content
+        ]}
+    if isinstance(content, str):
+        return {"type": "text", "text": content}
+    return {"type": "text", "text": str(content)}
+
+def _decode_content(conn, stored: dict):
+    """Decodes stored content; figures and tables stay blob references until displayed."""
+    kind = stored.get("type")
+    if kind in ("plot", "dataframe"):
+        return {**stored, "data": None}
+    if kind == "dashboard":
+        return [pio.from_json(_get_blob(conn, digest).decode("utf-8")) for digest in stored["blobs"]]
+    return stored.get("text", "")
+
+def resolve_content(content):
+    """Loads the figure or table behind a lazily loaded message, if it has one."""
+    if not (isinstance(content, dict) and content.get("blob") and content.get("data") is None):
+        return content
+    digest = content["blob"]
+    with _decoded_lock:
+        if digest in _decoded:
+            _decoded.move_to_end(digest)
+            return {**content, "data": _decoded[digest]}
+    conn = _connect()
+    try:
+        data = _get_blob(conn, digest)
+    finally:
+        conn.close()
+    if data is None:
+        return content
+    if content["type"] == "plot":
+        decoded = pio.from_json(data.decode("utf-8"))
+    else:
+        decoded = parquet_bytes_to_dataframe(data)
+    with _decoded_lock:
+        _decoded[digest] = decoded
+        if len(_decoded) > DECODED_CACHE_MAX_ENTRIES:
+            _decoded.popitem(last=False)
+    return {**content, "data": decoded}
+
+def _title_for(chat_history: list) -> str:
+    first_prompt = next((msg["content"] for msg in chat_history
+                         if msg["role"] == "user" and isinstance(msg["content"], str)), "")
+    return first_prompt[:80]
+
+def _session_key(session_id: str) -> str:
+    # Older callers pass the JSON file name
+    return session_id[:-len(".json")] if session_id.endswith(".json") else session_id
+
+def _other_dataset(conn, stored_hash: str, dataset_hash: str) -> bool:
+    """True when a session was saved with another dataset than `dataset_hash`.
+
+    Migrated JSON sessions are keyed by their blob's hash rather than the
+    dataset fingerprint, so they cannot be compared and never count.
+    """
+    if not stored_hash or not dataset_hash or stored_hash == dataset_hash:
+        return False
+    return conn.execute("SELECT 1 FROM blobs WHERE hash = ? AND kind = 'dataset'", (stored_hash,)).fetchone() is None
+
+# --- Public API ---
+
+def save_session(session_id: str, chat_history: list, dataset, dataset_hash: str = None,
+                 updated_at: float = None):
+    """Appends the messages not yet stored for a session in a single transaction.
+
+    `dataset` is the session's DataFrame, written once to a Parquet file named
+    by `dataset_hash`; a dict from `DataFrame.to_dict()` (the old format) is
+    stored as a JSON blob instead. With no dataset, only `dataset_hash` is
+    recorded (out-of-core datasets already live on disk).
+
+    Raises ValueError when the stored session cannot be an earlier state of
+    this conversation (it has more messages or another dataset), rather
+    than silently dropping the new messages.
+    """
+    if isinstance(dataset, pd.DataFrame) and not dataset_hash:
+        raise ValueError("dataset_hash is required when saving a DataFrame.")
+    session_id = _session_key(session_id)
+    now = updated_at or time.time()
+    conn = _connect()
+    try:
+        with conn:
+            stored = conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            exists = conn.execute("SELECT dataset_hash FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if exists and (stored > len(chat_history) or _other_dataset(conn, exists[0], dataset_hash)):
+                raise ValueError(f"Session {session_id} already holds a different conversation.")
+            if not exists:
+                if isinstance(dataset, pd.DataFrame):
+                    store_dataset(dataset, dataset_hash)
+                elif dataset is not None:
+                    dataset_hash = _put_blob(conn, "dataset", json.dumps(dataset, default=str).encode("utf-8"))
+                conn.execute(
+                    "INSERT INTO sessions (id, created_at, updated_at, dataset_hash, title, message_count) "
+                    "VALUES (?, ?, ?, ?, ?, 0)",
+                    (session_id, now, now, dataset_hash, _title_for(chat_history))
+                )
+            for seq, msg in enumerate(chat_history[stored:], start=stored):
+                conn.execute(
+                    "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                    (session_id, seq, msg["role"], json.dumps(_encode_content(conn, msg.get("content"))))
+                )
+            conn.execute(
+                "UPDATE sessions SET updated_at = ?, message_count = ? WHERE id = ?",
+                (now, max(stored, len(chat_history)), session_id)
+            )
+    finally:
+        conn.close()
+
+def load_session(session_id: str):
+    """Loads a session's chat history and DataFrame, or None if it does not exist.
+
+    Plots and tables in the history are blob references with `data` set to
+    None; `resolve_content` decodes them when they are displayed.
+    """
+    ensure_migrated()
+    session_id = _session_key(session_id)
+    conn = _connect()
+    try:
+        session = conn.execute("SELECT dataset_hash FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if session is None:
+            return None
+        rows = conn.execute(
+            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        chat_history = [{"role": role, "content": _decode_content(conn, json.loads(content))} for role, content in rows]
+        df = None
+        dataset_hash = session[0]
+        if dataset_hash and os.path.exists(_dataset_path(dataset_hash)):
+            df = load_dataset(dataset_hash)
+        elif dataset_hash:
+            blob = _get_blob(conn, dataset_hash)
+            # Sessions saved before datasets moved to Parquet; without a blob the
+            # hash names an out-of-core dataset that the caller reopens itself
+            if blob is not None:
+                df = pd.DataFrame.from_dict(json.loads(blob.decode("utf-8")))
+                dataset_hash = None # A blob hash, not a dataset fingerprint
+        return {"chat_history": chat_history, "dataframe": df, "dataset_hash": dataset_hash}
+    finally:
+        conn.close()
+
+def list_sessions() -> list:
+    """Lists all saved session ids, newest first."""
+    return [session["id"] for session in list_session_index(limit=None)]
+
+def list_session_index(limit: int = 50, search: str = None) -> list:
+    """Returns session metadata (id, title, timestamps, message count, dataset hash), newest first.
+
+    Only the sessions table is read, so this stays fast with thousands of sessions.
+    """
+    ensure_migrated()
+    if not os.path.exists(SESSION_DB_PATH):
+        return []
+    query = "SELECT id, title, created_at, updated_at, message_count, dataset_hash FROM sessions"
+    params = []
+    if search:
+        query += " WHERE title LIKE ? OR id LIKE ?"
+        params += [f"%{search}%", f"%{search}%"]
+    query += " ORDER BY updated_at DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    conn = _connect()
+    try:
+        keys = ("id", "title", "created_at", "updated_at", "message_count", "dataset_hash")
+        return [dict(zip(keys, row)) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+# --- Migration ---
+
+def _read_json_session(filepath: str) -> dict:
+    """Reads a session written by the old one-JSON-file-per-session format."""
+    with open(filepath, 'r') as f:
+        session_data = json.load(f)
+
+    for msg in session_data.get("chat_history", []):
+        content = msg.get("content")
+        if isinstance(content, dict) and content.get("type") == "plot":
+            if isinstance(content.get("data"), str):
+                content["data"] = pio.from_json(content["data"])
+        elif isinstance(content, dict) and content.get("type") == "dataframe":
+            if isinstance(content.get("data"), str):
+                content["data"] = parquet_bytes_to_dataframe(base64.b64decode(content["data"]))
+        elif isinstance(content, list) and content and all(isinstance(item, str) for item in content):
+            try:
+                msg["content"] = [pio.from_json(fig_json) for fig_json in content]
+            except Exception:
+                pass
+    return session_data
+
+def migrate_json_sessions(directory: str = CHAT_HISTORY_DIR) -> int:
+    """Imports legacy `<id>.json` sessions that are not in the database yet.
+
+    The JSON files are left in place; returns the number of sessions imported.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    json_files = [f for f in os.listdir(directory) if f.endswith(".json")]
+    if not json_files:
+        return 0
+    conn = _connect()
+    try:
+        known = {row[0] for row in conn.execute("SELECT id FROM sessions")}
+    finally:
+        conn.close()
+
+    imported = 0
+    for filename in json_files:
+        session_id = _session_key(filename)
+        if session_id in known:
+            continue
+        filepath = os.path.join(directory, filename)
+        try:
+            session_data = _read_json_session(filepath)
+            save_session(session_id, session_data.get("chat_history", []),
+                         session_data.get("dataframe_info"), updated_at=os.path.getmtime(filepath))
+            imported += 1
+        except Exception as e:
+            print(f"--- Session Migration Failed for {filename}: {e} ---")
+    if imported:
+        print(f"--- Migrated {imported} JSON Session(s) to SQLite ---")
+    return imported
+
+def ensure_migrated():
+    """Runs the JSON migration once per process."""
+    global _migrated
+    if not _migrated:
+        with _migration_lock:
+            if not _migrated:
+                migrate_json_sessions()
+                _migrated = True
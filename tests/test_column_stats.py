@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from column_stats import answer_from_stats, build_stats_index
+
+@pytest.fixture(scope="module")
+def index():
+    df = pd.DataFrame({
+        "region": ["North", "South", "North", None],
+        "sales": [10.0, 20.0, 30.0, 40.0],
+        "unit price": [1, 2, 3, 4],
+    })
+    return build_stats_index(df)
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("How many rows are there?", "4 rows"),
+    ("What is the average sales?", "average of `sales` is 25"),
+    ("total sales", "total of `sales` is 100"),
+    ("max unit price", "maximum of `unit price` is 4"),
+    ("How many missing values are in region?", "`region` has 1 missing values"),
+    ("how many unique values in region", "`region` has 2 distinct values"),
+])
+def test_simple_questions_are_answered(index, prompt, expected):
+    response = answer_from_stats(index, prompt)
+    assert response is not None and expected in response["content"]
+
+@pytest.mark.parametrize("prompt", [
+    "What is the average sales in the North region?",
+    "average sales by region",
+    "top 10 sales",
+    "average sales for 2023",
+    "How many rows have sales above 20?",
+    "mean region",
+])
+def test_questions_needing_code_fall_through(index, prompt):
+    assert answer_from_stats(index, prompt) is None
+
+def test_missing_values_table(index):
+    response = answer_from_stats(index, "how many missing values")
+    missing = response["content"]["data"].set_index("column")["missing"]
+    assert missing.to_dict() == {"region": 1, "sales": 0, "unit price": 0}
@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_loading import INT32_SAFE_ABS_MAX, optimize_dtypes
+
+def test_small_integers_become_int32_with_room_for_arithmetic():
+    df, _ = optimize_dtypes(pd.DataFrame({"qty": [1, 398, INT32_SAFE_ABS_MAX], "price": [3, 7, INT32_SAFE_ABS_MAX]}))
+    assert df["qty"].dtype == np.int32
+    assert (df["qty"] * 2).max() == 2 * INT32_SAFE_ABS_MAX
+    assert (df["qty"] * df["price"]).max() == INT32_SAFE_ABS_MAX ** 2
+
+@pytest.mark.parametrize("values", [[0, INT32_SAFE_ABS_MAX + 1], [-INT32_SAFE_ABS_MAX - 1, 0]])
+def test_wide_integers_stay_int64(values):
+    df, _ = optimize_dtypes(pd.DataFrame({"id": values}))
+    assert df["id"].dtype == np.int64
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+go = pytest.importorskip("plotly.graph_objects")
+from figure_postprocess import DOWNSAMPLE_META_KEY, downsample_figure, downsample_summary
+
+def _big_scatter(n=2000, **kwargs):
+    x = np.arange(n)
+    return go.Scatter(x=x, y=np.sin(x / 50.0), mode="markers", **kwargs)
+
+def test_every_per_point_array_is_subset_with_the_points():
+    n = 2000
+    labels = [f"p{i}" for i in range(n)]
+    trace = _big_scatter(
+        n,
+        text=labels,
+        hovertemplate=[f"%{{x}} {label}" for label in labels],
+        textposition=["top center"] * n,
+        error_y={"type": "data", "array": np.arange(n) * 0.1},
+        marker={"color": np.arange(n), "line": {"color": np.arange(n), "width": 1}},
+        selectedpoints=[0, 1, n - 1],
+    )
+    fig = downsample_figure(go.Figure(trace), max_points=200)
+    out = fig.data[0]
+    kept = len(out.x)
+    assert kept < n
+    for values in (out.text, out.hovertemplate, out.textposition, out.error_y.array,
+                   out.marker.color, out.marker.line.color):
+        assert len(values) == kept
+    # Labels still belong to the same points
+    assert [int(label[1:]) for label in out.text] == list(out.x)
+    assert np.array_equal(out.error_y.array, np.asarray(out.x) * 0.1)
+    # Selected points that survived are still selected, at their new positions
+    assert {int(out.x[i]) for i in out.selectedpoints} == {0, 1, n - 1} & {int(x) for x in out.x}
+
+def test_user_meta_list_is_left_untouched():
+    fig = go.Figure(_big_scatter(), layout={"meta": ["Q1", "Q2"]})
+    out = downsample_figure(fig, max_points=200)
+    assert out.layout.meta == ("Q1", "Q2")
+    assert len(out.data[0].x) < 2000
+
+def test_downsample_record_is_kept_in_dict_meta():
+    fig = go.Figure(_big_scatter(), layout={"meta": {"source": "sales"}})
+    out = downsample_figure(fig, max_points=200)
+    assert out.layout.meta["source"] == "sales"
+    assert out.layout.meta[DOWNSAMPLE_META_KEY]
+    assert downsample_summary(out).startswith("Showing")
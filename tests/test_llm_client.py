@@ -0,0 +1,43 @@
+import pytest
+
+from llm_client import FakeLLMBackend, LLMClient
+
+class QuotaError(Exception):
+    pass
+
+class FlakyStreamBackend(FakeLLMBackend):
+    """Streams one chunk of each answer, then fails with a quota error `failures` times."""
+    def __init__(self, failures, emit_before_failing):
+        super().__init__(["Total sales are 42."])
+        self.failures = failures
+        self.emit_before_failing = emit_before_failing
+
+    def stream(self, prompt, model, temperature, on_token):
+        if self.failures:
+            self.failures -= 1
+            if self.emit_before_failing:
+                on_token("Total ")
+            raise QuotaError("429 quota exceeded")
+        return super().stream(prompt, model, temperature, on_token)
+
+    @staticmethod
+    def is_quota_error(error):
+        return isinstance(error, QuotaError)
+
+def _client(backend):
+    return LLMClient(backend, requests_per_minute=6000, max_retries=2)
+
+def test_quota_error_before_any_token_is_retried(monkeypatch):
+    monkeypatch.setattr("llm_client.time.sleep", lambda seconds: None)
+    tokens = []
+    text = _client(FlakyStreamBackend(1, emit_before_failing=False)).invoke("q", on_token=tokens.append)
+    assert text == "".join(tokens) == "Total sales are 42."
+
+def test_quota_error_after_streaming_is_not_retried(monkeypatch):
+    monkeypatch.setattr("llm_client.time.sleep", lambda seconds: None)
+    tokens = []
+    backend = FlakyStreamBackend(1, emit_before_failing=True)
+    with pytest.raises(QuotaError):
+        _client(backend).invoke("q", on_token=tokens.append)
+    assert tokens == ["Total "]
+    assert backend.prompts == []
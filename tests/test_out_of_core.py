@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("duckdb")
+from out_of_core import check_sql
+
+@pytest.mark.parametrize("query", [
+    "SELECT SUM(load) FROM data",
+    "SELECT SUM(import) FROM data",
+    "SELECT * FROM data WHERE status = 'update pending'",
+    "SELECT * FROM data WHERE file = 'report.csv'",
+    "WITH a AS (SELECT * FROM data) SELECT COUNT(*) FROM a",
+    "FROM data SELECT region",
+    "SELECT region, SUM(sales) FROM data GROUP BY region;",
+])
+def test_check_sql_allows_selects_over_data(query):
+    assert check_sql(query)
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM/**/'/tmp/a.csv'",
+    "SELECT * FROM /* x */ '/tmp/a.csv'",
+    "SELECT * FROM -- x\n'/tmp/a.csv'",
+    'SELECT * FROM "/tmp/a.csv"',
+    "SELECT * FROM read_csv_auto('/tmp/a.csv')",
+    "SELECT * FROM data JOIN 'b.parquet' USING (id)",
+    "SELECT (SELECT max(x) FROM 'a.csv') FROM data",
+    "SELECT * FROM data UNION ALL SELECT * FROM 'b.csv'",
+    "SELECT * FROM other.data",
+    "SELECT * FROM duckdb_settings()",
+    "COPY data TO 'out.csv'",
+    "PRAGMA version",
+    "SET threads = 1",
+    "SELECT 1; SELECT 2",
+    "WITH a AS (SELECT 1) INSERT INTO t SELECT * FROM a",
+])
+def test_check_sql_rejects_other_tables_and_statements(query):
+    with pytest.raises(ValueError):
+        check_sql(query)
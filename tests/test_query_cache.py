@@ -0,0 +1,40 @@
+import pytest
+
+from query_cache import SemanticCache, _canonical_words, _signature
+
+COLUMNS = ["region", "sales", "customer"]
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SemanticCache(path=str(tmp_path / "cache.sqlite"), threshold=0.75)
+    cache.add("schema", "average sales per region", "df.groupby('region')['sales'].mean()")
+    return cache
+
+def _same_signature(a, b):
+    return _signature(_canonical_words(a), COLUMNS) == _signature(_canonical_words(b), COLUMNS)
+
+@pytest.mark.parametrize("a, b, same", [
+    ("average sales per region", "What is the average sales for each region?", True),
+    ("max sales", "mean sales", False),
+    ("sales in the North region", "sales in the South region", False),
+    ("orders by 'Alice'", "orders by 'alice'", False),
+    ("top 5 customers", "top 10 customers", False),
+])
+def test_signature(a, b, same):
+    assert _same_signature(a, b) is same
+
+def test_paraphrase_with_filler_reuses_code(cache):
+    assert cache.lookup("schema", "What is the average sales for each region?", COLUMNS) is not None
+
+def test_different_aggregation_does_not_reuse_code(cache):
+    assert cache.lookup("schema", "maximum sales per region", COLUMNS) is None
+
+def test_other_schema_does_not_reuse_code(cache):
+    assert cache.lookup("other", "average sales per region", COLUMNS) is None
+
+def test_threshold_gates_repeated_words(tmp_path):
+    strict = SemanticCache(path=str(tmp_path / "strict.sqlite"), threshold=0.99)
+    strict.add("schema", "sales by region", "code")
+    # Same words, but "region" twice: similar, not identical
+    assert strict.lookup("schema", "sales by region, region", COLUMNS) is None
+    assert strict.lookup("schema", "the sales by region", COLUMNS) == "code"
@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("asteval")
+import sandbox
+from sandbox import CodeExecutionError, InterpreterPool, ProcessSandbox, _evaluate, _PooledInterpreter
+
+def test_reset_restores_rebound_and_deleted_builtins():
+    pooled = _PooledInterpreter()
+    _evaluate(pooled.interpreter, "len = 7")
+    _evaluate(pooled.interpreter, "del pd")
+    _evaluate(pooled.interpreter, "leftover = 1")
+    pooled.reset()
+    assert _evaluate(pooled.interpreter, "len([1, 2, 3])") == 3
+    assert "pd" in pooled.interpreter.symtable
+    assert "leftover" not in pooled.interpreter.symtable
+
+def test_recycled_interpreter_does_not_leak_between_sessions():
+    pool = InterpreterPool(max_size=1, prewarm=1)
+    with pool.lease("a", {"df": [1, 2]}):
+        _evaluate(pool.interpreter_for("a"), "len = 7")
+    pool.release("a")
+    with pool.lease("b", {"df": [1, 2, 3]}):
+        assert _evaluate(pool.interpreter_for("b"), "len(df)") == 3
+
+def test_evaluate_raises_recorded_errors():
+    pooled = _PooledInterpreter()
+    pooled.interpreter.symtable["d"] = {"region": 1}
+    with pytest.raises(CodeExecutionError, match="KeyError"):
+        _evaluate(pooled.interpreter, "d['regoin']")
+
+def test_process_sandbox_shares_mixed_type_columns(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(sandbox, "SHARED_DATA_DIR", str(tmp_path))
+    box = ProcessSandbox(max_workers=1)
+    try:
+        box.share("s", pd.DataFrame({"mixed": [1, "x", None, 2.5]}), "mixed")
+        assert box.run("s", "df['mixed'].tolist()") == [1, "x", None, 2.5]
+    finally:
+        box.shutdown()
@@ -0,0 +1,18 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+import session_store
+from session_store import load_dataset, store_dataset
+
+@pytest.mark.parametrize("df", [
+    pd.DataFrame({1: [1.0, 2.0], "a": [1, "x"]}),
+    pd.DataFrame([[1, 2]], columns=["a", "a"]),
+    pd.DataFrame({("x", "y"): [1], ("x", "z"): [2]}),
+])
+def test_stored_dataset_keeps_labels_and_values(df, tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store, "DATASET_DIR", str(tmp_path))
+    store_dataset(df, "fingerprint")
+    loaded = load_dataset("fingerprint")
+    assert list(loaded.columns) == list(df.columns)
+    assert loaded.values.tolist() == df.values.tolist()
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv("DATASENSE_TRACE_FILE")
+TRACE_BUFFER_SPANS = int(os.getenv("DATASENSE_TRACE_BUFFER", "2000"))
+
+_current_trace = contextvars.ContextVar("datasense_trace_id", default=None)
+_current_span = contextvars.ContextVar("datasense_span_id", default=None)
+
+# --- Sinks ---
+class RingBufferSink:
+    """Keeps the most recent spans in memory for the debug panel."""
+    def __init__(self, max_spans: int = TRACE_BUFFER_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def emit(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def recent_traces(self, limit: int = 10) -> list:
+        """Returns the last `limit` traces, newest first, each as a list of spans."""
+        with self._lock:
+            spans = list(self.spans)
+        traces = OrderedDict()
+        for span in reversed(spans):
+            traces.setdefault(span["trace_id"], []).append(span)
+            if len(traces) > limit:
+                traces.popitem()
+                break
+        return [sorted(trace, key=lambda span: span["start"]) for trace in traces.values()]
+
+class JsonlFileSink:
+    """Appends one JSON object per span to a file."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, span: dict):
+        line = json.dumps(span, default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+
+# --- Tracer ---
+class Tracer:
+    """Records timed spans for each query, graph node and LLM call.
+
+    A span is a dict with name, trace/span/parent ids, start time, duration
+    and free-form attributes; sinks receive each span when it finishes.
+    """
+    def __init__(self, sinks: list = None):
+        self.sinks = sinks or []
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    @contextmanager
+    def span(self, name: str, trace_id: str = None, **attributes):
+        """Times a block; attributes can be added to the yielded dict inside it."""
+        outer_trace, outer_span = _current_trace.get(), _current_span.get()
+        trace_id = trace_id or outer_trace or new_trace_id()
+        span_id = uuid.uuid4().hex[:12]
+        trace_token = _current_trace.set(trace_id)
+        span_token = _current_span.set(span_id)
+        record = {
+            "name": name,
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": outer_span if outer_trace == trace_id else None,
+            "start": time.time(),
+            "attributes": dict(attributes),
+            "error": None,
+        }
+        start = time.perf_counter()
+        try:
+            yield record["attributes"]
+        except BaseException as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["duration_ms"] = (time.perf_counter() - start) * 1000
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            for sink in self.sinks:
+                try:
+                    sink.emit(record)
+                except Exception as e:
+                    print(f"--- Trace Sink Failed: {e} ---")
+
+def current_trace_id():
+    return _current_trace.get()
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+TRACE_BUFFER = RingBufferSink()
+TRACER = Tracer([TRACE_BUFFER])
+if TRACE_FILE:
+    TRACER.add_sink(JsonlFileSink(TRACE_FILE))
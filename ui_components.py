@@ -1,5 +1,13 @@
+import os
 import streamlit as st
-from utils import list_sessions, export_chart_to_png_bytes, export_chat_to_html
+import streamlit.components.v1 as components
+from concurrent.futures import Future
+from utils import list_session_index, export_chart_to_png_bytes, export_chat_to_html
+from session_store import resolve_content
+from figure_postprocess import downsample_summary
+
+# Saved analyses listed in the sidebar before "Show more"
+SIDEBAR_SESSIONS = 20
 
 def apply_custom_css():
     """Loads and applies the custom CSS."""
@@ -31,25 +39,57 @@ def render_sidebar():
             )
 
         st.markdown("### Saved Analyses")
-        sessions = list_sessions()
+        search = st.text_input("Search analyses", key="session_search", label_visibility="collapsed",
+                               placeholder="Search analyses...")
+        shown = st.session_state.get("sessions_shown", SIDEBAR_SESSIONS)
+        # Reads only the session index, never the sessions themselves
+        sessions = list_session_index(limit=shown + 1, search=search or None)
         if not sessions:
             st.info("No saved sessions found.")
         
-        for session_file in sessions:
-            session_name = session_file.replace(".json", "").replace("_", " ").title()
-            if st.button(session_name, key=f"load_{session_file}", use_container_width=True):
-                st.session_state.session_to_load = session_file
+        for session in sessions[:shown]:
+            session_name = session["title"] or session["id"].replace("_", " ").title()
+            if st.button(session_name, key=f"load_{session['id']}", use_container_width=True,
+                         help=f"{session['message_count'] or 0} messages"):
+                st.session_state.session_to_load = session["id"]
                 st.rerun()
+        if len(sessions) > shown and st.button("Show more", key="more_sessions", use_container_width=True):
+            st.session_state.sessions_shown = shown + SIDEBAR_SESSIONS
+            st.rerun()
 
 # In ui_components.py, replace the entire render_chat_message function with this:
 import streamlit as st
 from utils import list_sessions, export_chart_to_png_bytes, export_chat_to_html
 import plotly.graph_objects as go # Make sure this import is at the top of the file
 
-def render_chat_message(message: dict):
-    """Renders a single chat message with the specified card-based design."""
+# Rows of a tabular result sent to the browser at a time
+TABLE_PAGE_SIZE = 100
+
+def render_table_result(content: dict, key: str):
+    """Renders a table result one page at a time."""
+    table = content.get("data")
+    total_rows = content.get("total_rows", len(table))
+    page_count = max((len(table) - 1) // TABLE_PAGE_SIZE + 1, 1)
+    page = 1
+    if page_count > 1:
+        page = st.number_input(
+            f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, key=f"page_{key}"
+        )
+    start = (page - 1) * TABLE_PAGE_SIZE
+    st.dataframe(table.iloc[start:start + TABLE_PAGE_SIZE], use_container_width=True)
+    caption = f"Rows {start + 1}-{min(start + TABLE_PAGE_SIZE, len(table))} of {total_rows:,}"
+    if total_rows > len(table):
+        caption += f" (only the first {len(table):,} were kept)"
+    st.caption(caption)
+
+def render_chat_message(message: dict, key: str = "latest"):
+    """Renders a single chat message with the specified card-based design.
+
+    `key` must be unique per message so its widgets keep their state across reruns.
+    """
     role = message["role"]
-    content = message["content"]
+    # Messages from a loaded session decode their figure or table only when shown
+    content = message["content"] = resolve_content(message["content"])
     
     card_class = "user" if role == "user" else "assistant"
     
@@ -69,31 +109,174 @@ def render_chat_message(message: dict):
                 # This check ensures we only try to render valid Plotly figures.
                 if isinstance(fig, go.Figure):
                     st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+                    if downsample_summary(fig):
+                        st.caption(downsample_summary(fig))
                     
-                    # Add download button for the plot
-                    png_bytes = export_chart_to_png_bytes(fig)
-                    if png_bytes:
-                        st.download_button(
-                            label="Download Chart as PNG",
-                            data=png_bytes,
-                            file_name="chart.png",
-                            mime="image/png"
-                        )
+                    # Render the PNG only once the user asks for it; kaleido is slow
+                    ready_key = f"png_ready_{key}"
+                    if st.session_state.get(ready_key):
+                        png_bytes = export_chart_to_png_bytes(fig)
+                        if png_bytes:
+                            st.download_button(
+                                label="Download Chart as PNG",
+                                data=png_bytes,
+                                file_name="chart.png",
+                                mime="image/png",
+                                key=f"png_download_{key}"
+                            )
+                    elif st.button("Prepare PNG Download", key=f"png_prepare_{key}"):
+                        st.session_state[ready_key] = True
+                        st.rerun()
                 else:
                     # If it's not a valid figure, show an error inside the chat.
                     st.error("I was unable to generate a valid plot. Please try rephrasing your request.")
 
+            elif isinstance(content, dict) and content.get("type") == "dataframe":
+                render_table_result(content, key)
+
             elif isinstance(content, str):
                 st.markdown(content)
             else: # Fallback for other data types, e.g., raw dataframes
                 st.write(content)
                 
         st.markdown('</div>', unsafe_allow_html=True)
-def render_follow_up_buttons(questions: list):
-    """Renders follow-up questions as clean, clickable buttons."""
+@st.experimental_fragment(run_every=1)
+def _await_follow_ups(future: Future):
+    """Polls the background follow-up generation and reruns the app once it finishes."""
+    if future.done():
+        st.rerun()
+    st.caption("Suggesting follow-up questions...")
+
+def render_follow_up_buttons(questions):
+    """Renders follow-up questions as clean, clickable buttons.
+
+    `questions` may also be a Future from the agent, in which case a placeholder
+    is shown until the background generation completes.
+    """
+    if isinstance(questions, Future):
+        if not questions.done():
+            _await_follow_ups(questions)
+            return
+        questions = questions.result()
     if questions:
         cols = st.columns(len(questions))
         for i, question in enumerate(questions):
             if cols[i].button(question, use_container_width=True, key=f"follow_up_{i}"):
                 st.session_state.prompt_from_follow_up = question
-                st.rerun()
\ No newline at end of file
+                st.rerun()
+
+def render_agent_progress(events) -> dict:
+    """Shows a streaming query's progress and returns its final response.
+
+    Generated code appears as the LLM writes it, followed by whether it ran
+    and any retry; the box collapses once the answer is ready.
+    """
+    response = None
+    with st.status("Thinking...", expanded=True) as status:
+        code_area, code = st.empty(), ""
+        for event in events:
+            kind = event["type"]
+            if kind == "status":
+                status.update(label=event["text"])
+            elif kind == "token":
+                code += event["text"]
+                code_area.code(code.replace("```python", "").replace("```", ""), language="python")
+            elif kind == "code":
+                status.update(label="Running the generated code...")
+                code_area.code(event["code"] or "", language="python")
+            elif kind == "execution" and event["ok"]:
+                status.update(label="Preparing the answer...")
+            elif kind == "retry":
+                st.warning(f"That attempt failed: {event['error'][:300]}")
+                status.update(label=f"Fixing the code (attempt {event['attempt']})...")
+                code_area, code = st.empty(), ""
+            elif kind == "final":
+                response = event["response"]
+        failed = bool(response.get("error"))
+        status.update(label="Something went wrong" if failed else "Done",
+                      state="error" if failed else "complete", expanded=False)
+    return response
+
+@st.experimental_fragment(run_every=1)
+def _await_profile(future: Future):
+    """Polls the background profile build and reruns the app once it finishes."""
+    if future.done():
+        st.rerun()
+    st.caption("Profiling data in the background... You can keep chatting meanwhile.")
+
+def render_profile(future: Future):
+    """Shows a profile report once its background build has finished."""
+    if not future.done():
+        _await_profile(future)
+        return
+    try:
+        report_html = future.result()
+    except Exception as e:
+        st.error(f"Error generating EDA report: {e}")
+        return
+    st.download_button("Download Profile (HTML)", data=report_html, file_name="data_profile.html", mime="text/html")
+    # An iframe keeps the report's scripts and styles out of the app page
+    components.html(report_html, height=800, scrolling=True)
+
+@st.experimental_fragment(run_every=1)
+def render_dashboard_job(job):
+    """Shows a dashboard's charts as they finish, with placeholders for those still building."""
+    cols = st.columns(2)
+    for i, spec in enumerate(job.specs):
+        with cols[i % 2]:
+            if job.figures[i] is not None:
+                st.plotly_chart(job.figures[i], use_container_width=True)
+            elif job.errors[i]:
+                st.warning(f"Could not build: {spec}")
+            else:
+                st.info(f"Building: {spec}")
+    if job.done():
+        # Hand the finished charts to the regular dashboard view
+        st.rerun()
+
+def debug_enabled() -> bool:
+    """The debug panel is hidden unless the URL has ?debug=1 or DATASENSE_DEBUG is set."""
+    return st.query_params.get("debug") == "1" or os.getenv("DATASENSE_DEBUG") == "1"
+
+def render_debug_panel(agent_manager=None, limit: int = 10):
+    """Shows agent reuse and cache counters, then per-span timelines for the last few queries."""
+    from tracing import TRACE_BUFFER
+    from query_cache import QUERY_CACHE, SEMANTIC_CACHE
+    with st.expander("🛠️ Debug: recent query timelines"):
+        if agent_manager is not None:
+            agents = agent_manager.stats()
+            st.caption(
+                f"Agent: {agents['builds']} built, {agents['rebinds']} rebound, {agents['reuses']} reused "
+                f"(~{agents['saved_seconds']:.2f}s of graph compilation saved on reruns)"
+            )
+        query_stats, semantic_stats = QUERY_CACHE.stats(), SEMANTIC_CACHE.stats()
+        st.caption(
+            f"Query cache: {query_stats['hits']} hits, {query_stats['misses']} misses ({query_stats['entries']} entries) · "
+            f"Semantic cache: {semantic_stats['hits']} hits, {semantic_stats['misses']} misses"
+        )
+        traces = TRACE_BUFFER.recent_traces(limit)
+        if not traces:
+            st.info("No queries traced yet.")
+            return
+        for trace in traces:
+            root = next((span for span in trace if span["name"] == "query"), trace[0])
+            origin = min(span["start"] for span in trace)
+            st.markdown(f"**{root['attributes'].get('prompt', root['name'])}** — {root['duration_ms']:.0f} ms")
+            fig = go.Figure(go.Bar(
+                y=[span["name"] for span in trace],
+                x=[span["duration_ms"] for span in trace],
+                base=[(span["start"] - origin) * 1000 for span in trace],
+                orientation="h",
+                hovertext=[str(span["attributes"]) for span in trace],
+                marker_color=["#D9534F" if span["error"] else "#8A2BE2" for span in trace],
+            ))
+            fig.update_layout(
+                height=60 + 30 * len(trace), margin=dict(l=0, r=0, t=10, b=0),
+                xaxis_title="ms since query start", yaxis=dict(autorange="reversed")
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(
+                [{"span": span["name"], "ms": round(span["duration_ms"], 1), "error": span["error"], **span["attributes"]}
+                 for span in trace],
+                use_container_width=True
+            )
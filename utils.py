@@ -1,95 +1,81 @@
 import streamlit as st # <-- ADD THIS LINE
-import os
-import json
 import re
+import io
+import uuid
+import hashlib
+import zipfile
+from collections import OrderedDict
 from datetime import datetime
 import pandas as pd
 from plotly import io as pio
-import plotly.graph_objects as go
 
-CHAT_HISTORY_DIR = "chat_history"
+import session_store
+
+# Rendered PNGs kept in memory, keyed by a hash of the figure JSON
+PNG_CACHE_MAX_ENTRIES = 32
+_png_cache = OrderedDict()
 
 def get_session_id(first_query: str) -> str:
-    """Generates a unique session ID from the date and the first user query."""
+    """Generates a unique session ID from the date, the first user query and a random suffix.
+
+    The suffix keeps two analyses that start with the same question on the
+    same day from sharing (and overwriting) one session.
+    """
     date_str = datetime.now().strftime("%Y-%m-%d")
     sanitized_query = re.sub(r'[^\w\s-]', '', first_query).strip()
     sanitized_query = re.sub(r'[-\s]+', '_', sanitized_query).lower()
     query_part = sanitized_query[:40]
-    return f"{date_str}_{query_part}"
-
-def save_session(session_id: str, chat_history: list, df_info: dict):
-    """Saves the chat history and dataframe info to a JSON file."""
-    if not os.path.exists(CHAT_HISTORY_DIR):
-        os.makedirs(CHAT_HISTORY_DIR)
-    
-    serializable_history = []
-    for msg in chat_history:
-        new_msg = msg.copy()
-        content = new_msg.get("content")
-
-        if isinstance(content, dict) and content.get("type") == "plot":
-            fig = content.get("data")
-            if isinstance(fig, go.Figure):
-                content["data"] = pio.to_json(fig)
-        
-        elif isinstance(content, list) and all(isinstance(item, go.Figure) for item in content):
-             new_msg["content"] = [pio.to_json(fig) for fig in content]
-
-        serializable_history.append(new_msg)
+    return f"{date_str}_{query_part}_{uuid.uuid4().hex[:8]}"
 
-    session_data = {
-        "chat_history": serializable_history,
-        "dataframe_info": df_info
-    }
-    filepath = os.path.join(CHAT_HISTORY_DIR, f"{session_id}.json")
-    with open(filepath, 'w') as f:
-        json.dump(session_data, f, indent=4)
+def save_session(session_id: str, chat_history: list, df: pd.DataFrame, dataset_hash: str):
+    """Saves the messages added since the last save to the session store."""
+    session_store.save_session(session_id, chat_history, df, dataset_hash)
 
 def load_session(session_id: str):
-    """Loads a chat history and dataframe info from a JSON file."""
-    filepath = os.path.join(CHAT_HISTORY_DIR, session_id)
-    if not os.path.exists(filepath):
-        return None
-        
-    with open(filepath, 'r') as f:
-        session_data = json.load(f)
-
-    loaded_history = session_data.get("chat_history", [])
-    for msg in loaded_history:
-        content = msg.get("content")
-        
-        if isinstance(content, dict) and content.get("type") == "plot":
-            fig_json = content.get("data")
-            if isinstance(fig_json, str):
-                content["data"] = pio.from_json(fig_json)
-        
-        elif isinstance(content, list) and all(isinstance(item, str) for item in content):
-            try:
-                msg["content"] = [pio.from_json(fig_json) for fig_json in content]
-            except Exception:
-                pass
-                
-    return session_data
+    """Loads a chat history and its DataFrame from the session store."""
+    return session_store.load_session(session_id)
 
 def list_sessions() -> list:
-    """Lists all saved session files, newest first."""
-    if not os.path.exists(CHAT_HISTORY_DIR):
-        return []
-    files = os.listdir(CHAT_HISTORY_DIR)
-    json_files = [f for f in files if f.endswith('.json')]
-    return sorted(
-        json_files,
-        key=lambda f: os.path.getmtime(os.path.join(CHAT_HISTORY_DIR, f)),
-        reverse=True
-    )
+    """Lists all saved session ids, newest first."""
+    return session_store.list_sessions()
+
+def list_session_index(limit: int = 50, search: str = None) -> list:
+    """Lists saved session metadata for the sidebar, newest first."""
+    return session_store.list_session_index(limit, search)
+
+def figure_hash(fig) -> str:
+    """Content hash of a figure's JSON."""
+    return hashlib.sha256(pio.to_json(fig).encode("utf-8")).hexdigest()
 
 def export_chart_to_png_bytes(fig):
-    """Exports a Plotly figure to PNG bytes."""
+    """Exports a Plotly figure to PNG bytes, reusing earlier renders of the same figure."""
+    key = figure_hash(fig)
+    if key in _png_cache:
+        _png_cache.move_to_end(key)
+        return _png_cache[key]
     try:
-        return pio.to_image(fig, format='png', engine='kaleido')
+        png_bytes = pio.to_image(fig, format='png', engine='kaleido')
     except Exception as e:
         st.error(f"Error exporting chart: {e}")
         return None
+    _png_cache[key] = png_bytes
+    if len(_png_cache) > PNG_CACHE_MAX_ENTRIES:
+        _png_cache.popitem(last=False)
+    return png_bytes
+
+def export_charts_to_zip_bytes(figs: list) -> bytes:
+    """Exports several figures as PNGs in one zip archive.
+
+    Plotly keeps a single kaleido process alive between `to_image` calls, so
+    exporting in one pass pays its start-up cost at most once.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for i, fig in enumerate(figs, start=1):
+            png_bytes = export_chart_to_png_bytes(fig)
+            if png_bytes:
+                archive.writestr(f"chart_{i}.png", png_bytes)
+    return buffer.getvalue()
 
 def export_chat_to_html(chat_history: list) -> bytes:
     """Exports the entire chat log to a clean HTML string."""
@@ -110,6 +96,10 @@ def export_chat_to_html(chat_history: list) -> bytes:
         html += f'<h3>{role}</h3>'
         if isinstance(content, dict) and content.get("type") == "plot":
             html += "<p><em>[Plot was generated here.]</em></p>"
+        elif isinstance(content, dict) and content.get("type") == "dataframe":
+            table = content.get("data")
+            html += table.head(50).to_html(border=0) if isinstance(table, pd.DataFrame) else ""
+            html += f'<p><em>[{content.get("total_rows", 0)} rows in total.]</em></p>'
         elif isinstance(content, list):
             html += "<p><em>[Dashboard was generated here.]</em></p>"
         else: